@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""フォルダの一覧の作成時間を計測する
+
+    python benchmarks/bench_dirindex.py [--files 100000] [--dir 一時ディレクトリ]
+
+ダミーのファイルでフォルダのツリーを作り、次の時間を比べます。
+
+* os.walk ですべてを読む(QFileSystemModel がフォルダを開くたびに読むのと同じ量)
+* 保存した一覧がない状態での DirectoryIndex.scan
+* 保存した一覧を読み込んでからの DirectoryIndex.scan(変更なし)
+* 1 つのフォルダにファイルを追加してからの DirectoryIndex.scan
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pdf_preview.dirindex import DirectoryIndex  # noqa: E402
+
+SUFFIXES = (".xlsx", ".docx", ".txt", ".png", ".csv", ".log", ".tmp", ".bak", ".dat", ".xml")
+
+
+def make_tree(root: Path, files: int, per_dir=100, fanout=10):
+    """per_dir 個ずつファイルを置いたフォルダを、fanout 個ずつの階層にして作る。1 割が Office ドキュメント"""
+    dirs = [root]
+    i = 0
+    while len(dirs) * per_dir < files:
+        parent = dirs[i]
+        for j in range(fanout):
+            d = parent / "dir{:02d}".format(j)
+            d.mkdir()
+            dirs.append(d)
+        i += 1
+    n = 0
+    for d in dirs:
+        for k in range(per_dir):
+            if n >= files:
+                return len(dirs)
+            (d / "file{:03d}{}".format(k, SUFFIXES[n % len(SUFFIXES)])).touch()
+            n += 1
+    return len(dirs)
+
+
+def measure(label, fn):
+    start = time.perf_counter()
+    fn()
+    print("{:<28} {:8.3f} s".format(label, time.perf_counter() - start))
+
+
+def walk(root):
+    for _ in os.walk(root):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--dir", default=None, help="ツリーを作るディレクトリ。ネットワークドライブで計測する場合に指定する")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        root = Path(tmp) / "tree"
+        root.mkdir()
+        dirs = make_tree(root, args.files)
+        print("{} files in {} folders".format(args.files, dirs))
+        cache_path = Path(tmp) / "index.json"
+
+        measure("os.walk", lambda: walk(root))
+        measure("scan (cold)", lambda: DirectoryIndex(root, cache_path).scan())
+
+        def warm():
+            index = DirectoryIndex(root, cache_path)
+            index.load()
+            index.scan()
+        measure("load + scan (unchanged)", warm)
+
+        index = DirectoryIndex(root, cache_path)
+        index.load()
+        (root / "dir05" / "added.xlsx").touch()
+        changed = []
+        measure("scan (1 folder changed)", lambda: index.scan(changed.append))
+        print("changed: {}".format(changed))
+        print("index size: {:.1f} MB".format(cache_path.stat().st_size / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
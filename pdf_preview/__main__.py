@@ -36,13 +36,7 @@ def register():
     i = winreg.CreateKeyEx(h, "command")
     winreg.SetValue(i, "", winreg.REG_SZ, '{} -m pdf_preview "%1"'.format(sys.executable, path))
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("source", nargs="?")
-    parser.add_argument("-d", "--debug", action="store_true", default=False)
-    parser.add_argument("-i", "--install", action="store_true", default=False)
-    args = parser.parse_args()
-
+def setup_logging():
     # モジュールと同一ディレクトリにある logging.ini をよみこみ、loggerを設定する
     # log_dir をログファイルの出力先として設定する
     log_dir = util.log_dir()
@@ -53,6 +47,33 @@ def main():
     config = yaml.safe_load(open(config_path).read())
     config["handlers"]["file"]["filename"] = log_path
     logging.config.dictConfig(config)
+
+
+def main():
+    # py -m pdf_preview --watch <directory> : GUI なしでフォルダを監視する
+    # (watch という名前のフォルダを開けるように、サブコマンドではなくオプションにする)
+    if sys.argv[1:2] == ["--watch"]:
+        setup_logging()
+        from . import watch
+        watch.main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", nargs="?")
+    parser.add_argument("-d", "--debug", action="store_true", default=False)
+    parser.add_argument("-i", "--install", action="store_true", default=False)
+    parser.add_argument("--shared-cache", default=os.environ.get("PDF_PREVIEW_SHARED_CACHE"),
+                        help="変換結果を共有するキャッシュのディレクトリ")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="閲覧中のファイルを先読みで変換する。同時に変換するファイルの数")
+    parser.add_argument("--prefetch-budget", type=int, default=500,
+                        help="先読みで使うキャッシュの上限(MB)")
+    parser.add_argument("--timeout", type=int, default=180, help="1 件の変換の制限時間(秒)")
+    parser.add_argument("--draft", action="store_true", default=False,
+                        help="先に下書きの品質で表示してから、通常の品質に置き換える")
+    args = parser.parse_args()
+
+    setup_logging()
     LOGGER.debug("start")
 
     if args.install:
@@ -66,7 +87,8 @@ def main():
 
     if args.source:
         from . import main_window
-        main_window.main(args.source)
+        main_window.main(args.source, args.shared_cache, args.prefetch, args.prefetch_budget,
+                         args.timeout, args.draft)
 
 
 if __name__ == '__main__':
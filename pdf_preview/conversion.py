@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from pathlib import Path
+
+from PySide6 import QtCore
+
+from . import page_diff, pipeline, util
+from .shared_cache import SharedCache
+from .supervisor import Supervisor, stats_for
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ConversionState(object):
+    """MainWindow が依頼した変換の状態
+
+    変換を依頼するたびに世代を進め、古い世代の結果は表示しません。
+    新しい変換を依頼すると、前の変換のまだ始めていない通常の品質の変換はやめさせます。
+    そのため、シートの選択を変えたブックは、通常の品質の変換が終わるまで変換し直す対象に残しておきます。
+    変わったページは、最後に表示した PDF のページのハッシュと比べて求めます。
+    """
+
+    def __init__(self, viewer_path=None):
+        """
+        :param viewer_path: 最初に表示する PDF
+        """
+        self.generation = 0
+        self.viewer_path = Path(viewer_path) if viewer_path is not None else None
+        self.displayed_pages = None
+        self.cancel_event = threading.Event()
+        self.book_names = []
+        self.pending_force = []
+        self.full_ready = False
+        self.save_requested = False
+
+    def start(self, book_names, recreate_file=()):
+        """新しい変換を始める。ConvertThread には generation, cancel_event, pending_force を渡す"""
+        self.cancel_event.set()
+        self.cancel_event = threading.Event()
+        self.generation += 1
+        self.book_names = list(book_names)
+        self.pending_force = sorted(set(self.pending_force) | set(recreate_file))
+        self.full_ready = False
+
+    def merged(self, generation: int, full: bool) -> bool:
+        """変換の結果を受け取る。後から依頼した変換がある場合は表示しないので False を返す"""
+        if generation != self.generation:
+            return False
+        if full:
+            self.full_ready = True
+            self.pending_force = []
+        return True
+
+    def display(self, path, pages, loaded=True):
+        """表示する PDF を path に切り替えて、表示中の PDF から変わったページの範囲を返す
+
+        :param pages: path のページごとのハッシュ。分からない場合は None
+        :param loaded: ビューアーに PDF を読み込んであるかどうか
+        :return: page_diff.changed_pages の結果。読み込み直す必要があるが、変わったページが分からない場合は None
+        """
+        previous_path, previous = self.viewer_path, self.displayed_pages
+        self.viewer_path, self.displayed_pages = Path(path), pages
+        if not loaded or previous is None or pages is None:
+            return None
+        changes = page_diff.changed_pages(previous, pages)
+        if not changes and previous_path != self.viewer_path:
+            # 下書きから通常の品質に変わった場合など、ファイルが違うので読み込み直す
+            return None
+        return changes
+
+    def request_save(self) -> bool:
+        """すぐに保存できる場合は True。通常の品質の変換が終わっていない場合は、終わってから保存する"""
+        if self.full_ready:
+            return True
+        self.save_requested = True
+        return False
+
+    def take_save_request(self) -> bool:
+        """通常の品質の変換が終わって、待たせていた保存を行う場合は True"""
+        if self.save_requested and self.full_ready:
+            self.save_requested = False
+            return True
+        return False
+
+
+class SignalHolder(QtCore.QObject):
+    threadFinished = QtCore.Signal()
+    bookFailed = QtCore.Signal(str)
+    # 結合した PDF, ブックごとの PDF, 変換の世代, 通常の品質かどうか, ページごとのハッシュ
+    merged = QtCore.Signal(str, list, int, bool, object)
+
+
+class ConvertThread(QtCore.QRunnable):
+    def __init__(self, root: str, output_path: Path, all_books: list, force_files: list, sheet_selection: dict,
+                 shared_cache: SharedCache = None, timeout=180, draft=False, generation=0,
+                 cancel_event: threading.Event = None):
+        """
+        :param draft: 先に下書きの品質で変換・結合してから、通常の品質で変換・結合する
+        :param generation: 変換を依頼した順番。古い変換の結果を表示しないために使う
+        :param cancel_event: 新しい変換を依頼した時にセットされる。まだ始めていない通常の品質の変換をやめる
+        """
+        super(ConvertThread, self).__init__()
+        self.root = root
+        self.obj_connection = SignalHolder()
+        self.all_books = all_books
+        self.output_path = output_path
+        self.force_files = force_files
+        self.sheet_selection = sheet_selection.copy()
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self.draft = draft
+        self.generation = generation
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+
+    def run(self):
+        LOGGER.debug("PDF変換開始")
+        try:
+            self.convert()
+        except Exception:
+            LOGGER.exception("PDF の作成中にエラーが発生しました。")
+        finally:
+            # 先読みを再開させるので、途中でエラーになっても必ず通知する
+            self.obj_connection.threadFinished.emit()
+
+    def convert(self):
+        cache_dir = util.cache_dir()
+        pipeline.purge_cache(cache_dir)
+        supervisor = Supervisor(self.timeout, stats_for(cache_dir))
+
+        # 下書きの品質ですぐに表示する
+        if self.draft:
+            pdfs = pipeline.convert_books(self.root, self.all_books, self.sheet_selection, self.force_files,
+                                          self.shared_cache, supervisor=supervisor,
+                                          on_failed=self.obj_connection.bookFailed.emit, draft=True)
+            draft_path = pipeline.draft_output_path(self.output_path)
+            pipeline.merge_pdfs(pdfs, draft_path)
+            self.obj_connection.merged.emit(str(draft_path), [str(p) for p in pdfs], self.generation, False,
+                                            self.page_hashes(pdfs))
+
+        # PDF 作成。止まったブックは飛ばして、残りのブックを結合する
+        if not self.cancel_event.is_set():
+            pdfs = pipeline.convert_books(self.root, self.all_books, self.sheet_selection, self.force_files,
+                                          self.shared_cache, supervisor=supervisor,
+                                          on_failed=self.obj_connection.bookFailed.emit)
+
+            # PDF 結合
+            pipeline.merge_pdfs(pdfs, self.output_path)
+
+            # 結合が終わったことを通知。 WebEngineView での再描画を期待する。
+            self.obj_connection.merged.emit(str(self.output_path), [str(p) for p in pdfs], self.generation, True,
+                                            self.page_hashes(pdfs))
+
+    @staticmethod
+    def page_hashes(pdfs):
+        """結合した PDF のページごとのハッシュ。分からない場合は None
+
+        表示するかどうかは MainWindow が決めるので、ここでは前回の結果と比べたり保存したりしません。
+        """
+        try:
+            return page_diff.merged_page_hashes(pdfs)
+        except Exception:
+            LOGGER.warning("ページのハッシュを計算できませんでした。", exc_info=True)
+            return None
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+from . import util
+
+LOGGER = logging.getLogger(__name__)
+
+
+def join(rel: str, name: str) -> str:
+    """ルートからの相対パスを連結する。ルートは空文字列"""
+    return os.path.join(rel, name) if rel else name
+
+
+class DirectoryIndex(object):
+    """フォルダ以下の Office ドキュメントの一覧
+
+    フォルダごとの一覧(listing)を os.scandir で作り、ファイルに保存して次回の起動で使います。
+    フォルダの更新日時が前回と同じ場合は、そのフォルダを読み直しません。
+    フォルダの更新日時はフォルダ内のファイルの追加・削除・名前の変更で変わります。
+
+    listing: {"mtime_ns": フォルダの更新日時,
+              "dirs": [サブフォルダ名],
+              "files": [[ファイル名, サイズ, 更新日時]],
+              "has_docs": 以下に Office ドキュメントがあるか。調べていない場合は None}
+    """
+
+    version = 1
+
+    def __init__(self, root, cache_path=None):
+        """
+        :param root: 一覧を作るフォルダ
+        :param cache_path: 一覧を保存するファイル
+        """
+        self.root = Path(root)
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self._listings = {}
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._wakeup = threading.Condition(self._lock)
+        self._dirty = False
+
+    def load(self):
+        """保存した一覧を読み込む"""
+        if self.cache_path is None:
+            return
+        try:
+            data = util.read_json(self.cache_path)
+            if data.get("version") == self.version and data.get("root") == str(self.root):
+                with self._lock:
+                    self._listings = data["listings"]
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"version": self.version, "root": str(self.root), "listings": self._listings}
+            # 書き込み中に一覧が変わらないように、ロックしたまま文字列にする
+            text = json.dumps(data, ensure_ascii=False)
+            self._dirty = False
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            LOGGER.exception("フォルダの一覧を保存できませんでした。:{}".format(self.cache_path))
+
+    def listing(self, rel: str) -> Optional[dict]:
+        """フォルダの一覧。まだ調べていない場合は None"""
+        with self._lock:
+            listing = self._listings.get(rel)
+            if listing is None:
+                return None
+            return {"mtime_ns": listing["mtime_ns"], "dirs": list(listing["dirs"]),
+                    "files": [list(f) for f in listing["files"]], "has_docs": listing.get("has_docs")}
+
+    def has_docs(self, rel: str) -> Optional[bool]:
+        with self._lock:
+            listing = self._listings.get(rel)
+            return None if listing is None else listing.get("has_docs")
+
+    def request(self, rel: str):
+        """rel を先に調べてもらう"""
+        with self._wakeup:
+            self._requests.append(rel)
+            self._wakeup.notify_all()
+
+    def wake(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _read_dir(self, rel: str, st) -> dict:
+        dirs = []
+        files = []
+        with os.scandir(self.root / rel) as it:
+            for e in it:
+                try:
+                    if e.is_dir():
+                        if not e.name.startswith((".", "$")):
+                            dirs.append(e.name)
+                    elif e.name.lower().endswith(util.OFFICE_SUFFIXES) and not e.name.startswith("~$"):
+                        fst = e.stat()
+                        files.append([e.name, fst.st_size, fst.st_mtime_ns])
+                except OSError:
+                    continue
+        dirs.sort(key=str.lower)
+        files.sort(key=lambda f: f[0].lower())
+        return {"mtime_ns": st.st_mtime_ns, "dirs": dirs, "files": files, "has_docs": bool(files) or None}
+
+    def revalidate(self, rel: str) -> bool:
+        """フォルダが変わっていれば読み直す
+
+        :return: 一覧が変わった場合 True
+        :raise OSError: フォルダにアクセスできない
+        """
+        st = os.stat(self.root / rel)
+        with self._lock:
+            cached = self._listings.get(rel)
+            if cached is not None and cached["mtime_ns"] == st.st_mtime_ns:
+                return False
+        listing = self._read_dir(rel, st)
+        with self._lock:
+            if cached is not None and cached["dirs"] == listing["dirs"] and cached["files"] == listing["files"]:
+                cached["mtime_ns"] = listing["mtime_ns"]
+                self._dirty = True
+                return False
+            if cached is not None and listing["has_docs"] is None:
+                # サブフォルダの結果は scan の最後に計算し直す。それまでは前回の結果を使う
+                listing["has_docs"] = cached.get("has_docs")
+            self._listings[rel] = listing
+            self._dirty = True
+        return True
+
+    def _next_request(self) -> Optional[str]:
+        with self._lock:
+            return self._requests.popleft() if self._requests else None
+
+    def scan(self, on_listing=None, stop: threading.Event = None):
+        """ルート以下をすべて調べる
+
+        浅いフォルダから順に調べます。request() されたフォルダは先に調べます。
+
+        :param on_listing: 一覧が変わったフォルダの相対パスを引数にして呼ぶ
+        :param stop: セットされたら途中でやめる
+        """
+        queue = deque([""])
+        seen = set()
+        while queue:
+            if stop is not None and stop.is_set():
+                return
+            rel = self._next_request()
+            if rel is None:
+                rel = queue.popleft()
+            if rel in seen:
+                continue
+            seen.add(rel)
+            try:
+                changed = self.revalidate(rel)
+            except OSError:
+                LOGGER.debug("scan failed {}".format(rel))
+                continue
+            if changed and on_listing is not None:
+                on_listing(rel)
+            listing = self.listing(rel)
+            queue.extend(join(rel, d) for d in listing["dirs"])
+
+        with self._lock:
+            # なくなったフォルダの一覧を削除する
+            for rel in [r for r in self._listings if r not in seen]:
+                del self._listings[rel]
+                self._dirty = True
+            # Office ドキュメントがあるかどうかを、深いフォルダから順に決める
+            for rel in sorted(self._listings, key=lambda r: r.count(os.sep) if r else -1, reverse=True):
+                listing = self._listings[rel]
+                has_docs = bool(listing["files"]) or any(
+                    self._listings.get(join(rel, d), {}).get("has_docs") for d in listing["dirs"])
+                if listing.get("has_docs") != has_docs:
+                    listing["has_docs"] = has_docs
+                    self._dirty = True
+        self.save()
+
+    def serve(self, on_listing=None, on_finished=None, stop: threading.Event = None, interval=60.0):
+        """scan を interval 秒ごとに繰り返す。その間も request() されたフォルダを調べる"""
+        stop = stop if stop is not None else threading.Event()
+        while not stop.is_set():
+            self.scan(on_listing, stop)
+            if stop.is_set():
+                return
+            if on_finished is not None:
+                on_finished()
+            deadline = time.monotonic() + interval
+            while not stop.is_set():
+                with self._wakeup:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if not self._requests:
+                        self._wakeup.wait(remaining)
+                rel = self._next_request()
+                if rel is None:
+                    continue
+                try:
+                    if self.revalidate(rel) and on_listing is not None:
+                        on_listing(rel)
+                except OSError:
+                    LOGGER.debug("scan failed {}".format(rel))
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from PySide6 import QtCore
+from PySide6 import QtWidgets
+from PySide6.QtCore import Qt, Slot
+
+from . import util
+from .dirindex import DirectoryIndex, join
+
+LOGGER = logging.getLogger(__name__)
+
+
+def listing_cache_path(root, cache_dir=None) -> Path:
+    """フォルダの一覧の保存先。フォルダのパスごとに 1 つ"""
+    cache_dir = util.cache_dir() if cache_dir is None else Path(cache_dir)
+    key = hashlib.md5(str(Path(root).absolute()).encode("utf-8")).hexdigest()
+    return cache_dir / "dirindex" / (key + ".json")
+
+
+class DirectoryScanner(QtCore.QThread):
+    """DirectoryIndex をバックグラウンドで更新し続けるスレッド
+
+    signal: directoryScanned(rel: str) 一覧が変わったフォルダの相対パス
+    signal: scanFinished() ルート以下をすべて調べ終わった
+    """
+    directoryScanned = QtCore.Signal(str)
+    scanFinished = QtCore.Signal()
+
+    def __init__(self, dir_index: DirectoryIndex, interval=60.0, parent=None):
+        super(DirectoryScanner, self).__init__(parent)
+        self.dir_index = dir_index
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        try:
+            self.dir_index.serve(self.directoryScanned.emit, self.scanFinished.emit, self.stop_event, self.interval)
+        except Exception:
+            LOGGER.exception("フォルダを調べている途中でエラーが発生しました。")
+
+    def stop(self):
+        self.stop_event.set()
+        self.dir_index.wake()
+        self.wait()
+
+
+class FileTreeNode(object):
+    __slots__ = ("name", "rel", "is_dir", "size", "mtime_ns", "parent", "children", "row")
+
+    def __init__(self, name, rel, is_dir, size=0, mtime_ns=0, parent=None, row=0):
+        self.name = name
+        self.rel = rel
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.parent = parent
+        self.children = None  # まだ一覧を読み込んでいない場合は None
+        self.row = row
+
+
+class CheckableDirectoryModel(QtCore.QAbstractItemModel):
+    """チェックボックス付きのファイルツリー用モデル
+
+    QFileSystemModel の代わりに、DirectoryIndex が調べたフォルダの一覧を表示します。
+    一覧はフォルダを開いた時に読み込み、まだ調べていないフォルダは先に調べてもらいます。
+    Office ドキュメントがないフォルダは表示しません。
+
+    self.filePath(index) -> fullpath
+    self.data(index, Qt.CheckStateRole) -> check state
+    """
+
+    updateCheckState = QtCore.Signal(str, int)
+
+    COLUMNS = ("Name", "Size", "Date Modified")
+
+    def __init__(self, parent=None, cache_dir=None, interval=60.0):
+        """
+        :param cache_dir: フォルダの一覧を保存するディレクトリ
+        :param interval: フォルダを調べ直す間隔(秒)
+        """
+        super(CheckableDirectoryModel, self).__init__(parent)
+        self.file_order_widget: QtWidgets.QListWidget = None
+        self.cache_dir = cache_dir
+        self.interval = interval
+        self.root_path = ""
+        self.dir_index = None
+        self.scanner = None
+        self.root_node = FileTreeNode("", "", True)
+        self.dir_nodes = {"": self.root_node}
+        self.requested = set()
+        self.icon_provider = QtWidgets.QFileIconProvider()
+        self.icons = {}
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stopScanner)
+
+    def setBookListWidget(self, widget):
+        """Book の一覧を保持する ListWidget を設定する"""
+        self.file_order_widget = widget
+
+    def setRootPath(self, root) -> QtCore.QModelIndex:
+        """root 以下を表示する。ツリービューの setRootIndex に渡す index を返す"""
+        self.stopScanner()
+        self.root_path = str(root)
+        self.dir_index = DirectoryIndex(root, listing_cache_path(root, self.cache_dir))
+        self.dir_index.load()
+
+        self.beginResetModel()
+        self.root_node = FileTreeNode("", "", True)
+        self.dir_nodes = {"": self.root_node}
+        self.requested = set()
+        self.endResetModel()
+
+        self.scanner = DirectoryScanner(self.dir_index, self.interval, self)
+        self.scanner.directoryScanned.connect(self.on_directory_scanned)
+        self.scanner.scanFinished.connect(self.on_scan_finished)
+        self.scanner.start(QtCore.QThread.Priority.LowPriority)
+        return QtCore.QModelIndex()
+
+    @Slot()
+    def stopScanner(self):
+        if self.scanner is not None:
+            self.scanner.stop()
+            self.scanner = None
+
+    def rootPath(self) -> str:
+        return self.root_path
+
+    def node(self, index) -> FileTreeNode:
+        return index.internalPointer() if index.isValid() else self.root_node
+
+    def filePath(self, index) -> str:
+        return str(Path(self.root_path) / self.node(index).rel)
+
+    def relativePath(self, index) -> str:
+        """index位置の相対パスを取得"""
+        return self.node(index).rel
+
+    def isDir(self, index) -> bool:
+        return self.node(index).is_dir
+
+    def indexForNode(self, node: FileTreeNode, column=0) -> QtCore.QModelIndex:
+        if node is self.root_node:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.row, column, node)
+
+    #
+    # 一覧の読み込み
+    #
+    def _entries(self, rel, listing) -> list:
+        """表示する (名前, フォルダかどうか, サイズ, 更新日時) の一覧。フォルダが先
+
+        調べ終わっていないフォルダは、Office ドキュメントがないと分かるまで表示します。
+        """
+        entries = []
+        for name in listing["dirs"]:
+            if self.dir_index.has_docs(join(rel, name)) is not False:
+                entries.append((name, True, 0, 0))
+        entries.extend((name, False, size, mtime_ns) for name, size, mtime_ns in listing["files"])
+        return entries
+
+    def _populate(self, node: FileTreeNode):
+        """一覧を読み込んで node の子を更新する。一覧がまだない場合は何もしない"""
+        listing = self.dir_index.listing(node.rel)
+        if listing is None:
+            return
+        entries = self._entries(node.rel, listing)
+        parent_index = self.indexForNode(node)
+
+        if node.children is None:
+            node.children = []
+            if not entries:
+                if parent_index.isValid():
+                    # 展開の矢印を消す
+                    self.dataChanged.emit(parent_index, parent_index)
+                return
+            self.beginInsertRows(parent_index, 0, len(entries) - 1)
+            node.children = [self._new_node(node, row, entry) for row, entry in enumerate(entries)]
+            self.endInsertRows()
+            return
+
+        # なくなったものを後ろから削除する
+        names = {(name, is_dir) for name, is_dir, _, _ in entries}
+        for row in reversed(range(len(node.children))):
+            child = node.children[row]
+            if (child.name, child.is_dir) not in names:
+                self.beginRemoveRows(parent_index, row, row)
+                del node.children[row]
+                self._forget(child)
+                self._renumber(node, row)
+                self.endRemoveRows()
+
+        # 残ったものは entries と同じ順番なので、足りないものを順に挿入する
+        row = 0
+        for entry in entries:
+            name, is_dir, size, mtime_ns = entry
+            if row < len(node.children) and (node.children[row].name, node.children[row].is_dir) == (name, is_dir):
+                child = node.children[row]
+                if (child.size, child.mtime_ns) != (size, mtime_ns):
+                    child.size, child.mtime_ns = size, mtime_ns
+                    self.dataChanged.emit(self.indexForNode(child, 1), self.indexForNode(child, 2))
+            else:
+                self.beginInsertRows(parent_index, row, row)
+                node.children.insert(row, self._new_node(node, row, entry))
+                self._renumber(node, row + 1)
+                self.endInsertRows()
+            row += 1
+
+    def _new_node(self, parent: FileTreeNode, row: int, entry) -> FileTreeNode:
+        name, is_dir, size, mtime_ns = entry
+        child = FileTreeNode(name, join(parent.rel, name), is_dir, size, mtime_ns, parent, row)
+        if is_dir:
+            self.dir_nodes[child.rel] = child
+        return child
+
+    def _forget(self, node: FileTreeNode):
+        if node.is_dir:
+            self.dir_nodes.pop(node.rel, None)
+            self.requested.discard(node.rel)
+            for child in node.children or []:
+                self._forget(child)
+
+    @staticmethod
+    def _renumber(node: FileTreeNode, start=0):
+        for row in range(start, len(node.children)):
+            node.children[row].row = row
+
+    @Slot(str)
+    def on_directory_scanned(self, rel):
+        node = self.dir_nodes.get(rel)
+        if node is None:
+            return
+        if node.children is not None or rel in self.requested:
+            self._populate(node)
+
+    @Slot()
+    def on_scan_finished(self):
+        # Office ドキュメントがあるかどうかが決まったので、表示中のフォルダを更新する
+        for node in list(self.dir_nodes.values()):
+            # 親を更新した時に削除されたフォルダは飛ばす
+            if node.children is not None and self.dir_nodes.get(node.rel) is node:
+                self._populate(node)
+
+    #
+    # override
+    #
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, self.node(parent).children[row])
+
+    def parent(self, index=None):
+        if index is None:
+            return super(CheckableDirectoryModel, self).parent()
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self.indexForNode(index.internalPointer().parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = self.node(parent)
+        return len(node.children) if node.is_dir and node.children is not None else 0
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.COLUMNS)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        node = self.node(parent)
+        if not node.is_dir:
+            return False
+        # 読み込む前は展開できるものとして表示する
+        return node.children is None or len(node.children) > 0
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return node.is_dir and node.children is None
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        if not node.is_dir or node.children is not None:
+            return
+        if node.rel in self.requested:
+            return
+        self.requested.add(node.rel)
+        if self.dir_index.listing(node.rel) is None:
+            # まだ調べていないフォルダは先に調べてもらい、終わったら on_directory_scanned で読み込む
+            self.dir_index.request(node.rel)
+        else:
+            # ビューは行の追加の通知の中から fetchMore を呼ぶことがあるので、行の追加はその後にする
+            rel = node.rel
+            QtCore.QTimer.singleShot(0, self, lambda: self.on_directory_scanned(rel))
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.tr(self.COLUMNS[section])
+        return None
+
+    def flags(self, index):
+        """ファイルはチェックボックス付きであるフラグを追加"""
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        flags = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+        if not self.node(index).is_dir:
+            flags |= Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemNeverHasChildren
+        return flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node = self.node(index)
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return node.name
+            if node.is_dir:
+                return None
+            if column == 1:
+                return QtCore.QLocale().formattedDataSize(node.size)
+            if column == 2:
+                modified = QtCore.QDateTime.fromMSecsSinceEpoch(node.mtime_ns // 1000000)
+                return QtCore.QLocale().toString(modified, QtCore.QLocale.FormatType.ShortFormat)
+        elif role == Qt.ItemDataRole.DecorationRole and column == 0:
+            return self.icon(node)
+        elif role == Qt.ItemDataRole.CheckStateRole and column == 0 and not node.is_dir:
+            ## ファイル一覧に入っているかどうかでチェックの有無を返す
+            items = self.file_order_widget.findItems(node.rel, Qt.MatchFlag.MatchExactly)
+            if len(items) > 0:
+                return Qt.CheckState.Checked
+            else:
+                return Qt.CheckState.Unchecked
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role == QtCore.Qt.ItemDataRole.CheckStateRole and index.column() == 0:
+            LOGGER.debug("SELECT:{}".format(self.relativePath(index)))
+            self.dataChanged.emit(index, index)
+            self.updateCheckState.emit(self.relativePath(index), value)
+            return True
+        return False
+
+    def icon(self, node: FileTreeNode):
+        """アイコンは拡張子ごとに 1 回だけ取得する。ネットワーク上のファイルは取得に時間がかかるので"""
+        key = "" if node.is_dir else Path(node.name).suffix.lower()
+        if key not in self.icons:
+            if node.is_dir:
+                self.icons[key] = self.icon_provider.icon(QtWidgets.QFileIconProvider.IconType.Folder)
+            else:
+                self.icons[key] = self.icon_provider.icon(QtCore.QFileInfo(self.filePath(self.indexForNode(node))))
+        return self.icons[key]
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from . import util
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(path) -> str:
+    """ファイルの内容のハッシュを計算する。ファイルは少しずつ読むのでメモリは使わない"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FingerprintCache(object):
+    """ファイルの内容のハッシュを覚えておくキャッシュ
+
+    sources: 変換元のパス -> サイズ, 更新日時, 内容のハッシュ
+        サイズと更新日時が変わっていなければ、ハッシュを計算し直しません。
+    converted: 変換後の PDF のパス -> 変換元の内容のハッシュ
+        タイムスタンプだけが変わったファイルを変換し直さないために使います。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._sources = None
+        self._converted = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._sources is not None:
+            return
+        self._sources = {}
+        self._converted = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._sources = data.get("sources", {})
+            self._converted = data.get("converted", {})
+        except (IOError, ValueError):
+            pass
+
+    def hash(self, src_path) -> str:
+        """変換元のファイルの内容のハッシュを返す"""
+        key = str(src_path)
+        st = os.stat(src_path)
+        with self._lock:
+            self._load()
+            entry = self._sources.get(key)
+            if entry is not None and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                return entry["hash"]
+        digest = content_hash(src_path)
+        LOGGER.debug("content hash {}: {}".format(digest, src_path))
+        with self._lock:
+            self._sources[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": digest}
+            self._dirty = True
+        return digest
+
+    def converted_from(self, dst_path) -> Optional[str]:
+        """変換後の PDF を作った時の変換元の内容のハッシュを返す"""
+        with self._lock:
+            self._load()
+            return self._converted.get(str(dst_path))
+
+    def set_converted(self, dst_path, digest: str):
+        with self._lock:
+            self._load()
+            self._converted[str(dst_path)] = digest
+            self._dirty = True
+
+    def prune(self):
+        """キャッシュから消えた PDF の記録を削除する
+
+        変換元はネットワーク上にあることが多いので、ここでは確認しません。
+        """
+        with self._lock:
+            self._load()
+            for key in [k for k in self._converted if not os.path.exists(k)]:
+                del self._converted[key]
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"sources": self._sources, "converted": self._converted}
+            try:
+                util.write_json_atomic(self.path, data)
+                self._dirty = False
+            except OSError:
+                LOGGER.exception("ハッシュのキャッシュを保存できませんでした。:{}".format(self.path))
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(cache_dir) -> FingerprintCache:
+    """キャッシュディレクトリごとに 1 つの FingerprintCache を返す"""
+    path = Path(cache_dir) / "fingerprints.json"
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = FingerprintCache(path)
+        return _caches[path]
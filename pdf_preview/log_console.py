@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from collections import deque
+
+from PySide6 import QtCore
+from PySide6 import QtWidgets
+from PySide6.QtCore import Slot
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BufferedLogHandler(logging.Handler):
+    """ログレコードをリングバッファにためるハンドラ
+
+    emit はどのスレッドから呼ばれてもよく、UI には触れません。
+    バッファがあふれた場合は古いレコードから捨て、捨てた件数を数えておきます。
+    """
+
+    def __init__(self, capacity=2000):
+        super(BufferedLogHandler, self).__init__()
+        self.buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        self._buffer_lock = threading.Lock()
+
+    def emit(self, record):
+        with self._buffer_lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(record)
+
+    def drain(self):
+        """バッファの内容を取り出す
+
+        :return: (整形済みのメッセージのリスト, 捨てたレコードの件数)
+        """
+        with self._buffer_lock:
+            records = list(self.buffer)
+            self.buffer.clear()
+            dropped = self.dropped
+            self.dropped = 0
+        # 整形は取り出した分だけ行う。捨てたレコードは整形しない。
+        messages = []
+        for record in records:
+            try:
+                messages.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        return messages, dropped
+
+
+class LogConsole(QtWidgets.QPlainTextEdit):
+    """ログ表示用のコンソール
+
+    ログはハンドラのバッファにため、タイマーでまとめて追記します。
+    QPlainTextEdit は表示範囲だけをレイアウトするので、行数が増えても描画が重くなりません。
+    保持する行数は max_lines で制限し、古い行から削除します。
+    """
+
+    def __init__(self, parent=None, max_lines=5000, capacity=2000, interval=200):
+        """
+        :param max_lines: コンソールに保持する最大行数
+        :param capacity: 次の追記までにバッファにためるレコードの最大数
+        :param interval: 追記する間隔(ミリ秒)
+        """
+        super(LogConsole, self).__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setLineWrapMode(QtWidgets.QPlainTextEdit.LineWrapMode.NoWrap)
+        self.setMaximumBlockCount(max_lines)
+
+        self.handler = BufferedLogHandler(capacity)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    @Slot()
+    def flush(self):
+        """バッファにたまったログをまとめて追記する"""
+        messages, dropped = self.handler.drain()
+        if not messages and not dropped:
+            return
+
+        lines = []
+        if dropped:
+            lines.append("... {} 件のログを省略しました ...".format(dropped))
+        lines.extend(messages)
+
+        # 末尾を表示していた場合だけ追従する。スクロールして過去のログを見ている時は動かさない。
+        scroll_bar = self.verticalScrollBar()
+        at_bottom = scroll_bar.value() == scroll_bar.maximum()
+        self.appendPlainText("\n".join(lines))
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
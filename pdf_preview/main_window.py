@@ -1,140 +1,67 @@
 # -*- coding: utf-8 -*-
-import os
-import json
 import logging
-from datetime import timedelta, datetime
-from glob import glob
 from pathlib import Path
 
 import openpyxl
-from pypdf import PdfMerger
 from PySide6 import QtCore
+from PySide6 import QtGui
 from PySide6 import QtWidgets
 from PySide6.QtCore import QUrl, Slot, Qt
 from PySide6.QtGui import QGuiApplication, QDesktopServices, QKeySequence
 from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QFileSystemModel, QTreeView, QSplitter, \
+from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QTreeView, QSplitter, \
     QListWidgetItem, QAbstractItemView
 from PySide6.QtWidgets import QVBoxLayout
 
-from . import saveAsPDF, util
+from . import pipeline, search_index, util
+from .conversion import ConversionState, ConvertThread
+from .file_tree import CheckableDirectoryModel
+from .log_console import LogConsole
+from .prefetch import Prefetcher, neighbors
+from .shared_cache import SharedCache
+from .state_store import SelectionStore
+from .thumbnails import ThumbnailTask, ThumbnailView
 import shutil
 
 LOGGER = logging.getLogger(__name__)
 
 
-def merge_pdfs(paths, output):
-    """PDFファイルを結合する"""
-    if LOGGER.isEnabledFor(logging.DEBUG):
-        for path in paths:
-            LOGGER.debug("merge from {}".format(path))
-        LOGGER.debug("merge to {}".format(output))
+class IndexTask(QtCore.QRunnable):
+    """ブックごとの PDF から文字列を取り出して、全文検索の索引を作る"""
 
-    merger = PdfMerger()
-    for path in paths:
-        merger.append(open(path, "rb"))
-    merger.write(str(output))
-    merger.close()
-    LOGGER.debug("merged")
-
-
-class SignalHolder(QtCore.QObject):
-    threadFinished = QtCore.Signal()
-
-
-class ConvertThread(QtCore.QRunnable):
-    def __init__(self, root: str, output_path: Path, all_books: list, force_files: list, sheet_selection: dict):
-        super(ConvertThread, self).__init__()
-        self.root = root
-        self.obj_connection = SignalHolder()
-        self.all_books = all_books
-        self.output_path = output_path
-        self.force_files = force_files
-        self.sheet_selection = sheet_selection.copy()
+    def __init__(self, pdfs: list):
+        super(IndexTask, self).__init__()
+        self.pdfs = pdfs
 
     def run(self):
-        LOGGER.debug("PDF変換開始")
-        cache_dir = util.cache_dir()
-        pdfs = []
-        cached_file = glob(str(cache_dir) + r"\*")
-        for f in cached_file:
-            if datetime.fromtimestamp(os.stat(f).st_birthtime) < datetime.now() - timedelta(days=2):
-                LOGGER.debug("purge cache:{} ({})".format(os.stat(f).st_birthtime, f))
-                try:
-                    os.unlink(f)
-                except PermissionError:
-                    pass
-        # PDF 作成
-        for book_filename in self.all_books:
-            sheets = self.sheet_selection.get(book_filename, None)
-            force = True if book_filename in self.force_files else False
-            converter = saveAsPDF.Converter()
-            r = converter.convert(str(Path(self.root) / book_filename), sheets, force, cache_dir)
-            if r is not None:
-                pdfs.append(r)
-
-        # PDF 結合
-        merge_pdfs(pdfs, self.output_path)
-
-        # 結合が終わったことを通知。 WebEngineView での再描画を期待する。
-        self.obj_connection.threadFinished.emit()
-        return
-
+        for pdf in self.pdfs:
+            try:
+                search_index.load_index(pdf)
+            except Exception:
+                LOGGER.warning("索引を作れませんでした。:{}".format(pdf), exc_info=True)
 
-class CheckableFileSystemModel(QFileSystemModel):
-    """チェックボックス付きのファイルツリー用モデル
 
-    self.filepath(index) -> fullpath
-    self.data(index, Qt.CheckStateRole) -> check state
-    """
+class SearchSignal(QtCore.QObject):
+    finished = QtCore.Signal(list, int)  # (ページ番号, 前後の文字列) の一覧, 検索の通し番号
 
-    updateCheckState = QtCore.Signal(str, int)
 
-    def __init__(self, parent=None):
-        super(CheckableFileSystemModel, self).__init__(parent)
-        self.file_order_widget: QtWidgets.QListWidget = None
-        self.setNameFilters(["*.xls", "*.xlsx", "*.xlsm", "*.doc", "*.docx"])
+class SearchTask(QtCore.QRunnable):
+    """全文検索する。索引ができていないブックは索引を作るので、UI のスレッドでは実行しない"""
 
-    def setBookListWidget(self, widget):
-        """Book の一覧を保持する ListWidget を設定する"""
-        self.file_order_widget = widget
+    def __init__(self, pdfs: list, query: str, serial: int):
+        super(SearchTask, self).__init__()
+        self.pdfs = pdfs
+        self.query = query
+        self.serial = serial
+        self.obj_connection = SearchSignal()
 
-    def checkState(self, index):
-        if self.filePath(index) in self.check:
-            return QtCore.Qt.CheckState.Checked
-        else:
-            return QtCore.Qt.CheckState.Unchecked
-
-    def relativePath(self, index):
-        """index位置の相対パスを取得"""
-        return str(Path(self.filePath(index)).relative_to(self.rootPath()))
-
-    #
-    # override
-    #
-    def flags(self, index):
-        """チェックボックス付きであるフラグを追加"""
-        return QFileSystemModel.flags(self, index) | Qt.ItemFlag.ItemIsUserCheckable
-
-    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
-        if role != Qt.ItemDataRole.CheckStateRole:
-            return QFileSystemModel.data(self, index, role)
-        else:
-            if index.column() == 0:
-                ## ファイル一覧に入っているかどうかでチェックの有無を返す
-                items = self.file_order_widget.findItems(self.relativePath(index), Qt.MatchFlag.MatchExactly)
-                if len(items) > 0:
-                    return Qt.CheckState.Checked
-                else:
-                    return Qt.CheckState.Unchecked
-
-    def setData(self, index, value, role=None):
-        if role == QtCore.Qt.ItemDataRole.CheckStateRole and index.column() == 0:
-            LOGGER.debug("SELECT:{}".format(self.relativePath(index)))
-            self.dataChanged.emit(index, index)
-            self.updateCheckState.emit(self.relativePath(index), value)
-            return True
-        return super().setData(self, index, value, role)
+    def run(self):
+        try:
+            results = search_index.search(self.pdfs, self.query)
+        except Exception:
+            LOGGER.warning("検索できませんでした。:{}".format(self.query), exc_info=True)
+            results = []
+        self.obj_connection.finished.emit(results, self.serial)
 
 
 class FileOrderWidget(QtWidgets.QListWidget):
@@ -219,6 +146,17 @@ class FileOrderWidget(QtWidgets.QListWidget):
         else:
             super().addItem(filename)
 
+    def setFailed(self, filename):
+        """変換に失敗したファイルを赤く表示する"""
+        for item in self.findItems(filename, Qt.MatchFlag.MatchExactly):
+            item.setForeground(QtGui.QBrush(Qt.GlobalColor.red))
+            item.setToolTip(self.tr("PDF に変換できませんでした。"))
+
+    def clearFailed(self):
+        for i in range(self.count()):
+            self.item(i).setData(Qt.ItemDataRole.ForegroundRole, None)
+            self.item(i).setToolTip("")
+
     @Slot(str, int)
     def updateFileList(self, filename, value):
         """ツリービューでファイルのチェック状態が変更されたとき。
@@ -298,6 +236,73 @@ class ExcelSheetsView(QtWidgets.QListWidget):
         self.sheetSelectionChanged.emit(self.currentBookName, sheet_name, check_state)
 
 
+class SearchPanel(QWidget):
+    """選択したブックを全文検索するパネル
+
+    signal: pageSelected(page: int) page: 結合した PDF でのページ番号(1 から)
+    """
+    pageSelected = QtCore.Signal(int)
+
+    def __init__(self, parent=None):
+        super(SearchPanel, self).__init__(parent)
+        self.pdfs = []
+        self.serial = 0
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.query = QtWidgets.QLineEdit()
+        self.query.setPlaceholderText(self.tr("Search"))
+        self.query.setClearButtonEnabled(True)
+        self.query.returnPressed.connect(self.search)
+        self.results = QtWidgets.QListWidget()
+        self.results.itemActivated.connect(self.on_item_activated)
+        self.results.itemClicked.connect(self.on_item_activated)
+
+        lo = QVBoxLayout()
+        lo.setContentsMargins(0, 0, 0, 0)
+        lo.addWidget(self.query)
+        lo.addWidget(self.results)
+        self.setLayout(lo)
+
+    def setPdfs(self, pdfs: list):
+        """検索する PDF を結合した順番で設定する"""
+        self.pdfs = pdfs
+
+    @Slot()
+    def search(self):
+        """別のスレッドで検索する。結果は on_search_finished で表示する"""
+        self.serial += 1
+        self.results.clear()
+        # まだ始めていない前の検索はやめる
+        self.pool.clear()
+        query = self.query.text()
+        if not query.strip():
+            return
+        item = QtWidgets.QListWidgetItem(self.tr("Searching..."))
+        item.setFlags(Qt.ItemFlag.NoItemFlags)
+        self.results.addItem(item)
+        task = SearchTask(list(self.pdfs), query, self.serial)
+        task.obj_connection.finished.connect(self.on_search_finished)
+        self.pool.start(task)
+
+    @Slot(list, int)
+    def on_search_finished(self, results: list, serial: int):
+        if serial != self.serial:
+            return
+        self.results.clear()
+        LOGGER.debug("search {}: {} pages".format(self.query.text(), len(results)))
+        for page, snippet in results:
+            item = QtWidgets.QListWidgetItem("p.{}  {}".format(page, snippet))
+            item.setData(Qt.ItemDataRole.UserRole, page)
+            self.results.addItem(item)
+        if results:
+            self.results.setCurrentRow(0)
+            self.pageSelected.emit(results[0][0])
+
+    @Slot(QListWidgetItem)
+    def on_item_activated(self, item: QListWidgetItem):
+        self.pageSelected.emit(item.data(Qt.ItemDataRole.UserRole))
+
+
 class LeftPane(QWidget):
     """Windowの左半分
 
@@ -306,6 +311,7 @@ class LeftPane(QWidget):
     """
     file_selection_changed = QtCore.Signal(list)
     sheet_selection_changed = QtCore.Signal(list, str, str, Qt.CheckState)
+    file_highlighted = QtCore.Signal(str)
 
     def __init__(self, parent, root):
         super(LeftPane, self).__init__(parent)
@@ -314,13 +320,14 @@ class LeftPane(QWidget):
         #
         # ファイルのツリービュー
         #
-        self.model = CheckableFileSystemModel(self)
+        self.model = CheckableDirectoryModel(self)
         self.tv = QTreeView(self)
         self.tv.setModel(self.model)
         self.tv.setRootIndex(self.model.setRootPath(root))
         self.tv.header().setStretchLastSection(False)  # 一番右のカラムをストレッチする→False
         self.tv.setColumnWidth(0, 200)
         self.tv.doubleClicked.connect(self.open_file)
+        self.tv.selectionModel().currentChanged.connect(self.on_tree_current_changed)
 
         #
         # ファイル一覧のビュー
@@ -359,6 +366,11 @@ class LeftPane(QWidget):
         LOGGER.debug("ファイルを開きます:{}".format(index))
         QDesktopServices.openUrl(QUrl.fromLocalFile(self.model.filePath(index)))
 
+    def on_tree_current_changed(self, current: QtCore.QModelIndex, previous: QtCore.QModelIndex):
+        """ツリーで選択中のファイルを通知する"""
+        if current.isValid() and not self.model.isDir(current):
+            self.file_highlighted.emit(self.model.relativePath(current))
+
     @Slot(str, str, Qt.CheckState)
     def on_sheetSelectionUpdated(self, filename, sheet_name, state):
         paths = [self.book_list.item(i).text() for i in range(self.book_list.count())]
@@ -386,15 +398,11 @@ class LeftPane(QWidget):
 
 class MainWindow(QMainWindow):
     def load_sheet_selection(self) -> dict:
-        """シート選択の状態を復元する"""
-        try:
-            try:
-                json_data = json.load(open(self.sheet_selection_filename, "r"))
-            except UnicodeDecodeError:
-                json_data = json.load(open(self.sheet_selection_filename, "r", encoding="utf-8"))
-        except IOError:
-            return
-        return json_data
+        """シート選択の状態を復元する。同じ名前の別のフォルダの状態は使わない"""
+        state = self.state_store.load()
+        if state is not None and not pipeline.state_belongs_to(state, self.source_dir):
+            return None
+        return state
     
     def apply_sheet_selection(self, json_data):
         try:
@@ -427,21 +435,37 @@ class MainWindow(QMainWindow):
             path = item.text()  # path(relative)
             json_data["files"].append(path)
         json_data["sheets"] = self.left_pane.sheet_list.sheet_selection
-        # LOGGER.debug("save setting: {}: {}".format(self.sheet_selection_filename, json_data))
-        LOGGER.debug("save")
-        json.dump(json_data, open(self.sheet_selection_filename, "w", encoding="utf-8"), indent=4, ensure_ascii=False)
+        json_data["folder"] = str(Path(self.source_dir).absolute())
+        # 書き込みはストアがまとめて別スレッドで行う
+        self.state_store.save(json_data)
 
     def save(self):
-        """PDFを保存する"""
+        """PDFを保存する
+
+        下書きを表示している場合でも、保存するのは通常の品質の PDF です。
+        通常の品質の変換が終わっていなければ、変換が終わってから保存します。
+        """
+        if not self.conversion.request_save():
+            LOGGER.info("変換が終わってから保存します。")
+            return
         LOGGER.debug("save to:{}".format(self.saveto_path))
         shutil.copy(self.output_path, self.saveto_path)
 
-    def __init__(self, source_path: str):
+    def __init__(self, source_path: str, shared_cache: SharedCache = None, prefetch=0,
+                 prefetch_budget=500 * 1024 * 1024, timeout=180, draft=False):
         """
 
         :param source_path: 対象のファイルまたはディレクトリ
+        :param shared_cache: 変換結果を共有するキャッシュ
+        :param prefetch: 先読みで同時に変換するファイルの数。0 の場合は先読みしない
+        :param prefetch_budget: 先読みで使うキャッシュの上限(バイト)
+        :param timeout: 1 件の変換の制限時間(秒)
+        :param draft: 先に下書きの品質で表示してから、通常の品質に置き換える
         """
         super(MainWindow, self).__init__()
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self.draft = draft
 
         cache_dir = util.cache_dir()
         if Path(source_path).is_file():
@@ -453,11 +477,14 @@ class MainWindow(QMainWindow):
         else:
             # 出力先は対象ディレクトリの中。ディレクトリと同名で拡張子を変えたもの。
             self.source_dir = source_path
-            self.output_path = cache_dir / Path(self.source_dir).with_suffix(".PDF").name
+            self.output_path = pipeline.folder_output_path(self.source_dir, cache_dir)
             self.saveto_path = Path(self.source_dir) / Path(source_path).with_suffix(".PDF").name
 
-        self.sheet_selection_filename = cache_dir / self.output_path.with_suffix(".PDF.json")
+        self.sheet_selection_filename = pipeline.state_path(self.output_path)
+        self.state_store = SelectionStore(self.sheet_selection_filename)
 
+        # 変換の状態。表示中の PDF と、保存する通常の品質の PDF ができているかどうか
+        self.conversion = ConversionState(self.output_path)
         self.setWindowTitle(str(self.output_path))
 
         # ファイルツリーのモデルを作成
@@ -466,20 +493,54 @@ class MainWindow(QMainWindow):
         self.left_pane.file_selection_changed.connect(self.convertToPdf)  # ファイル選択の変更
         self.left_pane.sheet_selection_changed.connect(self.on_sheet_selection_changed)  # シート選択の変更
 
+        # 閲覧中のファイルの先読み
+        self.prefetcher = None
+        if prefetch > 0:
+            self.prefetcher = Prefetcher(self.source_dir, prefetch, prefetch_budget, self.shared_cache,
+                                         self.timeout, self)
+            self.left_pane.file_highlighted.connect(self.on_file_highlighted)
+            self.left_pane.model.updateCheckState.connect(self.on_file_checked)
+
         self.web = QWebEngineView()
         self.web.settings().setAttribute(self.web.settings().WebAttribute.PluginsEnabled, True)
         self.web.settings().setAttribute(self.web.settings().WebAttribute.PdfViewerEnabled, True)
         self.viewer_html = str(Path(__file__).parent / Path('pdfjs-dist/web/viewer.html'))
         LOGGER.debug(self.viewer_html)
 
-        # ログ表示用のテキストエリア
-        self.console = QtWidgets.QTextEdit()
-        self.console.setReadOnly(True)
-        self.console.setLineWrapMode(QtWidgets.QTextEdit.LineWrapMode.NoWrap)
+        # ログ表示用のコンソール
+        self.console = LogConsole()
+
+        # サムネイルと全文検索の索引を作るスレッド
+        self.background_pool = QtCore.QThreadPool(self)
+        self.background_pool.setMaxThreadCount(1)
+        self.background_pool.setThreadPriority(QtCore.QThread.Priority.LowPriority)
+
+        # ページのサムネイル
+        self.thumbnails = ThumbnailView()
+        self.thumbnails.pageClicked.connect(self.go_to_page)
+
+        # 全文検索
+        self.search_panel = SearchPanel()
+        self.search_panel.pageSelected.connect(self.go_to_page)
+        find_action = QtGui.QAction(self)
+        find_action.setShortcut(QKeySequence.StandardKey.Find)
+        find_action.triggered.connect(self.search_panel.query.setFocus)
+        self.addAction(find_action)
+
+        side = QSplitter(QtCore.Qt.Vertical)
+        side.addWidget(self.search_panel)
+        side.addWidget(self.thumbnails)
+        side.setStretchFactor(0, 0)
+        side.setStretchFactor(1, 1)
+        viewer = QSplitter()
+        viewer.addWidget(side)
+        viewer.addWidget(self.web)
+        viewer.setStretchFactor(0, 0)  # サムネイルの幅は固定
+        viewer.setStretchFactor(1, 1)
 
         # 右側の上下分割用の QSplitter を作成
         self.right_pane = QSplitter(QtCore.Qt.Vertical)
-        self.right_pane.addWidget(self.web)
+        self.right_pane.addWidget(viewer)
         self.right_pane.addWidget(self.console)
         self.right_pane.setStretchFactor(0, 1)  # 上部のウィジェット（webビューア）を優先
         self.right_pane.setStretchFactor(1, 0)  # 下部のウィジェット（ログ表示）を固定
@@ -491,33 +552,11 @@ class MainWindow(QMainWindow):
         base.setStretchFactor(0, 0)  # 左はウインドウサイズ変更に追随させない
         base.setStretchFactor(1, 1)
 
-        # 標準出力と標準エラー出力を textedit にリダイレクト   
-        class QTextEditLogger(logging.Handler):
-            def __init__(self, text_edit):
-                super().__init__()
-                self.text_edit = text_edit
-
-            def emit(self, record):
-                msg = self.format(record)
-                QtCore.QMetaObject.invokeMethod(
-                    self.text_edit,
-                    "append",
-                    QtCore.Qt.QueuedConnection,
-                    QtCore.Q_ARG(str, msg)
-                )
-                QtCore.QMetaObject.invokeMethod(
-                    self.text_edit.verticalScrollBar(),
-                    "setValue",
-                    QtCore.Qt.QueuedConnection,
-                    QtCore.Q_ARG(int, self.text_edit.verticalScrollBar().maximum())
-                )
-
-        # Create a QTextEditLogger and set it up
-        text_edit_logger = QTextEditLogger(self.console)
+        # ログをコンソールに表示する
         log_format = "%(asctime)s:%(levelname)-7s:%(threadName)s:%(filename)s:%(lineno)d:%(funcName)s:%(message)s"
-        text_edit_logger.setFormatter(logging.Formatter(log_format))
-        logging.getLogger().addHandler(text_edit_logger)
-        
+        self.console.handler.setFormatter(logging.Formatter(log_format))
+        logging.getLogger().addHandler(self.console.handler)
+
         # メニューの追加
         menu = self.menuBar().addMenu(self.tr("File"))
         save_action = menu.addAction(self.tr("Save"), self.save)
@@ -535,19 +574,100 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(base)
         self.resize(QtWidgets.QApplication.screens()[0].size() * 0.7)
 
+    def closeEvent(self, event):
+        # 書き込み待ちのシート選択の状態を保存してから閉じる
+        self.state_store.flush()
+        if self.conversion.save_requested:
+            LOGGER.warning("変換が終わっていないので保存しませんでした。:{}".format(self.saveto_path))
+        super(MainWindow, self).closeEvent(event)
+
+    @Slot(str, list, int, bool, object)
+    def on_merged(self, path: str, pdfs: list, generation: int, full: bool, pages):
+        """結合した PDF を表示する。後から依頼した変換がある場合は表示しない
+
+        表示中の PDF から変わったページがあれば、最初の変わったページを表示する。
+        変わったページがない場合は表示中のページのまま
+
+        :param pages: 結合した PDF のページごとのハッシュ。分からない場合は None
+        """
+        if not self.conversion.merged(generation, full):
+            return
+        if self.conversion.take_save_request():
+            self.save()
+        changes = self.conversion.display(path, pages, not self.web.url().isEmpty())
+        if changes:
+            LOGGER.info("変更されたページ: {}".format(
+                ", ".join("{}-{}".format(first, last) if first != last else str(first) for first, last in changes)))
+            self.reload(changes[0][0])
+        elif changes is not None:
+            LOGGER.debug("変更されたページはありません")
+        else:
+            self.reload()
+
+        # サムネイルと全文検索の索引はバックグラウンドで作る。作成済みのブックはそれを使う
+        task = ThumbnailTask(pdfs, generation)
+        task.obj_connection.ready.connect(self.on_thumbnails_ready)
+        self.background_pool.start(task)
+        if full:
+            self.background_pool.start(IndexTask(pdfs))
+            self.search_panel.setPdfs(pdfs)
+
+    @Slot(list, int)
+    def on_thumbnails_ready(self, paths: list, generation: int):
+        if generation == self.conversion.generation:
+            self.thumbnails.setThumbnails(paths)
+
+    @Slot(int)
+    def go_to_page(self, page: int):
+        """PDF.js で指定したページを表示する"""
+        self.web.page().runJavaScript("PDFViewerApplication.page = {};".format(page))
+
     @Slot()
-    def reload(self):
+    def reload(self, page=None):
+        """PDF を読み込み直す。page を指定しない場合は表示中のページを表示する"""
+        if page is None and not self.web.url().isEmpty():
+            self.web.page().runJavaScript("PDFViewerApplication.page", 0, self.load_viewer)
+        else:
+            self.load_viewer(page)
+
+    def load_viewer(self, page=None):
         # url = QUrl.fromLocalFile(str(self.output_path.absolute()))
         # LOGGER.debug("PDF表示を更新します {}".format(url))
         # self.web.load(url)
 
-        param = QUrl.fromLocalFile(str(self.output_path.absolute())).toString()
-        url= QUrl.fromUserInput(QUrl.fromLocalFile(self.viewer_html).toString() + "?file={}".format(param))
-        LOGGER.debug("PDF表示を更新します {}".format(self.output_path))
+        param = QUrl.fromLocalFile(str(self.conversion.viewer_path.absolute())).toString()
+        url = QUrl.fromLocalFile(self.viewer_html).toString() + "?file={}".format(param)
+        if isinstance(page, (int, float)) and page > 1:
+            # PDF.js は読み込んだ後に #page= のページを表示する
+            url += "#page={}".format(int(page))
+        url = QUrl.fromUserInput(url)
+        LOGGER.debug("PDF表示を更新します {}".format(self.conversion.viewer_path))
+        no_fragment = QUrl.UrlFormattingOption.RemoveFragment
+        same_document = url.adjusted(no_fragment) == self.web.url().adjusted(no_fragment)
         # if self.web.url() != url:
         self.web.load(url)
+        if url.hasFragment() and same_document:
+            # #page= だけが違う場合はページ内の移動になり、PDF を読み込み直さないので
+            self.web.reload()
         return
 
+    def selected_books(self) -> list:
+        return [self.left_pane.book_list.item(i).text() for i in range(self.left_pane.book_list.count())]
+
+    @Slot(str)
+    def on_file_highlighted(self, book_name):
+        """ツリーで選択したファイルを先読みする"""
+        if book_name not in self.selected_books():
+            self.prefetcher.request([book_name], self.left_pane.sheet_list.sheet_selection)
+
+    @Slot(str, int)
+    def on_file_checked(self, book_name, value):
+        """チェックしたファイルの近くのファイルを先読みする"""
+        if Qt.CheckState(value) == Qt.CheckState.Checked:
+            selected = self.selected_books()
+            books = [b for b in neighbors(self.source_dir, book_name) if b not in selected]
+            self.prefetcher.request(books, self.left_pane.sheet_list.sheet_selection)
+
     # シートの選択を変えたら、変えたブックだけPDF変換してすべて結合
     @Slot(list, str, str, Qt.CheckState)
     def on_sheet_selection_changed(self, paths: list, filename: str, sheet_name: str, state: Qt.CheckState):
@@ -561,16 +681,30 @@ class MainWindow(QMainWindow):
             recreate_file = []
         LOGGER.debug("PDF作成:{}".format(book_names))
         self.save_sheet_selection()
-        p = ConvertThread(self.source_dir, self.output_path, book_names, recreate_file,
-                          self.left_pane.sheet_list.sheet_selection)
-        p.obj_connection.threadFinished.connect(self.reload)
+
+        # 前の変換の結果は表示しない。前の変換でまだ変換し直していないブックも、強制的に変換し直す
+        self.conversion.start(book_names, recreate_file)
+        p = ConvertThread(self.source_dir, self.output_path, book_names, self.conversion.pending_force,
+                          self.left_pane.sheet_list.sheet_selection, self.shared_cache, self.timeout,
+                          self.draft, self.conversion.generation, self.conversion.cancel_event)
+        p.obj_connection.merged.connect(self.on_merged)
+        p.obj_connection.bookFailed.connect(self.left_pane.book_list.setFailed)
+        self.left_pane.book_list.clearFailed()
+        if self.prefetcher is not None:
+            # 本番の変換が終わるまで先読みは待たせる
+            self.prefetcher.pause()
+            p.obj_connection.threadFinished.connect(self.prefetcher.resume)
         QtCore.QThreadPool.globalInstance().start(p)
 
 
-def main(source):
+def main(source, shared_cache_dir=None, prefetch=0, prefetch_budget=500, timeout=180, draft=False):
     LOGGER.debug("source:{}".format(source))
+    shared_cache = None
+    if shared_cache_dir:
+        LOGGER.debug("shared cache:{}".format(shared_cache_dir))
+        shared_cache = SharedCache(shared_cache_dir)
     QGuiApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
     app = QApplication()
-    main_window = MainWindow(source)
+    main_window = MainWindow(source, shared_cache, prefetch, prefetch_budget * 1024 * 1024, timeout, draft)
     main_window.show()
     app.exec_()
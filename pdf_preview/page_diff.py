@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+from . import util
+
+LOGGER = logging.getLogger(__name__)
+
+
+def pages_path(pdf_path) -> Path:
+    """ページごとのハッシュの配置場所。PDF と同じキャッシュのキーで、PDF の隣に置く"""
+    return Path(str(pdf_path) + ".pages.json")
+
+
+def _stamp(pdf_path) -> dict:
+    st = os.stat(pdf_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _hash_page(page) -> str:
+    """ページの内容のハッシュ
+
+    ページの大きさと向き、描画命令(コンテンツストリーム)、ページで使う画像などのデータから計算します。
+    PDF を作り直すと作成日時などは変わりますが、ページの内容が同じならハッシュは変わりません。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr([float(x) for x in page.mediabox]).encode("ascii"))
+    h.update(str(page.rotation).encode("ascii"))
+    contents = page.get_contents()
+    if contents is not None:
+        h.update(contents.get_data())
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            h.update(name.encode("utf-8"))
+            try:
+                h.update(xobjects[name].get_object().get_data())
+            except Exception:
+                LOGGER.debug("get_data failed {}".format(name), exc_info=True)
+    return h.hexdigest()
+
+
+def page_hashes(pdf_path) -> list:
+    """PDF のページごとのハッシュ"""
+    from pypdf import PdfReader
+    reader = PdfReader(str(pdf_path))
+    return [_hash_page(page) for page in reader.pages]
+
+
+def load_page_hashes(pdf_path) -> list:
+    """PDF のページごとのハッシュを返す。保存したものがないか PDF が変わっている場合は計算して保存する"""
+    stamp = _stamp(pdf_path)
+    path = pages_path(pdf_path)
+    try:
+        data = util.read_json(path)
+        if data["stamp"] == stamp:
+            return data["pages"]
+    except (IOError, ValueError, KeyError):
+        pass
+    LOGGER.debug("hash pages {}".format(pdf_path))
+    hashes = page_hashes(pdf_path)
+    util.write_json_atomic(path, {"stamp": stamp, "pages": hashes})
+    return hashes
+
+
+def changed_pages(old: list, new: list) -> list:
+    """ページのハッシュの一覧を比べて、変わったページの範囲を返す
+
+    ページ数が同じ場合はページごとに比べます。ページ数が違う場合は、先頭と末尾から同じページを除いた範囲を
+    変わったページとします。ページが削除されただけの場合は、削除された位置のページを変わったものとします。
+    (末尾が削除された場合は最後のページ)
+
+    :return: 新しい一覧での [最初のページ, 最後のページ] (1 から) の一覧
+    """
+    if len(old) == len(new):
+        changed = [i for i in range(len(new)) if old[i] != new[i]]
+    else:
+        prefix = 0
+        while prefix < min(len(old), len(new)) and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < min(len(old), len(new)) - prefix and old[-1 - suffix] == new[-1 - suffix]:
+            suffix += 1
+        changed = list(range(prefix, len(new) - suffix))
+        if not changed and new:
+            changed = [min(prefix, len(new) - 1)]
+
+    ranges = []
+    for i in changed:
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i + 1, i + 1])
+    return ranges
+
+
+def merged_page_hashes(pdfs: list) -> list:
+    """結合した PDF のページごとのハッシュ
+
+    結合した PDF ではなく、ブックごとの PDF のハッシュをつなげて使います。
+
+    :param pdfs: 結合したブックごとの PDF
+    """
+    hashes = []
+    for pdf in pdfs:
+        hashes.extend(load_page_hashes(pdf))
+    return hashes
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, datetime
+from glob import glob
+from pathlib import Path
+
+from pypdf import PdfMerger
+
+from . import fingerprint, saveAsPDF, util
+from .shared_cache import SharedCache
+from .supervisor import ConversionCancelled, Supervisor
+
+LOGGER = logging.getLogger(__name__)
+
+
+def folder_output_path(folder, cache_dir=None) -> Path:
+    """フォルダを結合した PDF の配置場所"""
+    cache_dir = util.cache_dir() if cache_dir is None else Path(cache_dir)
+    return cache_dir / Path(folder).with_suffix(".PDF").name
+
+
+def draft_output_path(output_path) -> Path:
+    """下書きの品質で結合した PDF の配置場所"""
+    return Path(output_path).with_suffix(".draft.PDF")
+
+
+def state_path(output_path) -> Path:
+    """結合した PDF に対応するシート選択の状態ファイル"""
+    return Path(output_path).with_suffix(".PDF.json")
+
+
+def state_belongs_to(state: dict, folder) -> bool:
+    """シート選択の状態がそのフォルダのものかどうか
+
+    状態ファイルはフォルダ名だけで決まるので、別の場所にある同じ名前のフォルダと同じファイルになります。
+    状態に保存したフォルダのパスと比べます。パスを保存していない古い状態は、ブックがそのフォルダにあるかで判断します。
+    """
+    if "folder" in state:
+        return os.path.normcase(os.path.abspath(state["folder"])) == os.path.normcase(os.path.abspath(folder))
+    files = state.get("files", [])
+    return len(files) > 0 and all((Path(folder) / f).exists() for f in files)
+
+
+def _manifest_path(output) -> Path:
+    return Path(str(output) + ".merged.json")
+
+
+def _manifest(paths) -> list:
+    manifest = []
+    for path in paths:
+        st = os.stat(path)
+        manifest.append([str(path), st.st_size, st.st_mtime_ns])
+    return manifest
+
+
+def merge_pdfs(paths, output):
+    """PDFファイルを結合する
+
+    前回と同じ PDF を同じ順番で結合する場合は、結合し直しません。
+    GUI と監視が同じ PDF を読み書きすることがあるので、一時ファイルに書き込んでから置き換えます。
+    """
+    manifest = _manifest(paths)
+    try:
+        if Path(output).exists() and util.read_json(_manifest_path(output)) == manifest:
+            LOGGER.debug("same merge {}".format(output))
+            os.utime(_manifest_path(output))  # 使用中であることを purge_cache に知らせる
+            return
+    except (IOError, ValueError):
+        pass
+
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        for path in paths:
+            LOGGER.debug("merge from {}".format(path))
+        LOGGER.debug("merge to {}".format(output))
+
+    fd, tmp_name = tempfile.mkstemp(prefix=Path(output).name, suffix=".tmp", dir=str(Path(output).parent))
+    merger = PdfMerger()
+    try:
+        for path in paths:
+            merger.append(open(path, "rb"))
+        with os.fdopen(fd, "wb") as f:
+            merger.write(f)
+        os.replace(tmp_name, output)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    finally:
+        merger.close()
+    util.write_json_atomic(_manifest_path(output), manifest)
+    LOGGER.debug("merged")
+
+
+def _in_use(cache_dir, days) -> set:
+    """最近結合に使ったファイル"""
+    in_use = set()
+    limit = time.time() - timedelta(days=days).total_seconds()
+    for manifest in glob(str(cache_dir) + r"\*.merged.json"):
+        try:
+            if os.stat(manifest).st_mtime < limit:
+                continue
+            paths = [manifest, manifest[:-len(".merged.json")]] + [m[0] for m in util.read_json(manifest)]
+        except (IOError, ValueError):
+            continue
+        # PDF の隣に置いた全文検索の索引とページのハッシュも残す
+        paths += [p + suffix for p in paths for suffix in (".text.json", ".pages.json")]
+        in_use.update(os.path.normcase(os.path.abspath(p)) for p in paths)
+    return in_use
+
+
+def purge_cache(cache_dir, days=2):
+    """古いキャッシュを削除する
+
+    最近結合に使ったファイルは、作成日時が古くても削除しません。
+    """
+    in_use = _in_use(cache_dir, days)
+    cached_file = glob(str(cache_dir) + r"\*")
+    for f in cached_file:
+        if os.path.normcase(os.path.abspath(f)) in in_use:
+            continue
+        if datetime.fromtimestamp(os.stat(f).st_birthtime) < datetime.now() - timedelta(days=days):
+            LOGGER.debug("purge cache:{} ({})".format(os.stat(f).st_birthtime, f))
+            try:
+                os.unlink(f)
+            except PermissionError:
+                pass
+    # PDF の隣に置いたディレクトリ(サムネイルなど)は、PDF と一緒に削除する
+    for directory in Path(cache_dir).glob("*.pdf.*"):
+        if directory.is_dir() and not directory.with_suffix("").exists():
+            LOGGER.debug("purge cache:{}".format(directory))
+            shutil.rmtree(directory, ignore_errors=True)
+    fingerprint.cache_for(cache_dir).prune()
+
+
+def _init_worker():
+    # 変換用のスレッドで COM を使えるようにする
+    import pythoncom
+    pythoncom.CoInitialize()
+
+
+def convert_books(root, book_names: list, sheet_selection: dict, force_files=(), shared_cache: SharedCache = None,
+                  max_workers=1, supervisor: Supervisor = None, on_failed=None, draft=False) -> list:
+    """ブックを PDF に変換する
+
+    変換に失敗したブックは飛ばして、残りのブックを変換します。
+
+    :param root: ブックの相対パスの基準となるディレクトリ
+    :param book_names: 変換するブックの相対パス
+    :param sheet_selection: ブックごとのシートの選択
+    :param force_files: キャッシュがあっても変換し直すブック
+    :param max_workers: 同時に変換するブックの数。1 の場合は呼び出したスレッドで順番に変換する
+    :param supervisor: 指定した場合、制限時間を過ぎた変換の Office を終了させる
+    :param on_failed: 変換に失敗したブックの相対パスを引数にして呼ぶ
+    :param draft: 品質を落として速く変換する
+    :return: 変換後の PDF のパス。book_names の順番で、変換できなかったブックは含まない
+    """
+    cache_dir = util.cache_dir()
+    fingerprints = fingerprint.cache_for(cache_dir)
+
+    def convert(book_name):
+        src_filename = str(Path(root) / book_name)
+        sheets = sheet_selection.get(book_name, None)
+        force = book_name in force_files
+
+        def do_convert(on_office=None):
+            return saveAsPDF.Converter.convert(src_filename, sheets, force, cache_dir, fingerprints, shared_cache,
+                                               on_office, draft)
+
+        try:
+            if supervisor is None:
+                return do_convert()
+            return supervisor.run(src_filename, do_convert)
+        except ConversionCancelled:
+            LOGGER.info("変換をやめました。:{}".format(src_filename))
+            return None
+        except Exception:
+            LOGGER.exception("変換に失敗しました。:{}".format(src_filename))
+            if on_failed is not None:
+                on_failed(book_name)
+            return None
+
+    if max_workers <= 1:
+        results = [convert(book_name) for book_name in book_names]
+    else:
+        with ThreadPoolExecutor(max_workers, thread_name_prefix="convert", initializer=_init_worker) as executor:
+            results = list(executor.map(convert, book_names))
+    fingerprints.save()
+    if supervisor is not None:
+        supervisor.flush()
+    return [r for r in results if r is not None]
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from pathlib import Path
+
+from PySide6 import QtCore
+from PySide6.QtCore import Slot
+
+from . import pipeline, util
+from .shared_cache import SharedCache
+from .supervisor import Supervisor, stats_for
+
+LOGGER = logging.getLogger(__name__)
+
+
+def neighbors(root, book_name: str, count=2) -> list:
+    """同じフォルダで book_name の前後にある Office ドキュメントの相対パスを返す"""
+    parent = (Path(root) / book_name).parent
+    try:
+        with os.scandir(parent) as it:
+            names = sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(util.OFFICE_SUFFIXES))
+    except OSError:
+        return []
+    name = Path(book_name).name
+    if name not in names:
+        return []
+    i = names.index(name)
+    near = names[max(0, i - count):i] + names[i + 1:i + 1 + count]
+    return [str(Path(book_name).parent / n) for n in near]
+
+
+def cache_size(cache_dir) -> int:
+    """キャッシュディレクトリにある PDF の合計サイズ"""
+    total = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for e in it:
+                if e.is_file() and e.name.lower().endswith(".pdf"):
+                    total += e.stat().st_size
+    except OSError:
+        pass
+    return total
+
+
+class PrefetchSignal(QtCore.QObject):
+    finished = QtCore.Signal(str)
+
+
+class PrefetchTask(QtCore.QRunnable):
+    def __init__(self, root: str, book_name: str, sheets: dict, shared_cache: SharedCache = None,
+                 supervisor: Supervisor = None):
+        """
+        :param supervisor: 変換を監視する。Prefetcher はこれを使って変換中の Office を終了させる
+        """
+        super(PrefetchTask, self).__init__()
+        self.root = root
+        self.book_name = book_name
+        self.sheets = sheets
+        self.shared_cache = shared_cache
+        self.supervisor = supervisor
+        self.obj_connection = PrefetchSignal()
+
+    def run(self):
+        LOGGER.debug("先読み変換開始:{}".format(self.book_name))
+        try:
+            pipeline.convert_books(self.root, [self.book_name], {self.book_name: self.sheets},
+                                   shared_cache=self.shared_cache, supervisor=self.supervisor)
+        except Exception:
+            # 先読みの失敗は本番の変換でもう一度試すので、ログに残すだけにする
+            LOGGER.warning("先読み変換に失敗しました。:{}".format(self.book_name), exc_info=True)
+        self.obj_connection.finished.emit(self.book_name)
+
+
+class Prefetcher(QtCore.QObject):
+    """ツリーで選択中のファイルや、チェックしたファイルの近くのファイルを先回りして変換する
+
+    変換結果はキャッシュに入るだけなので、後でチェックした時にすぐ表示できます。
+    本番の変換を始める時は、変換中の先読みの Office を終了させて、その先読みは後でやり直します。
+    本番の変換が動いている間は新しい先読みを始めず、待っている先読みも後回しにします。
+    """
+
+    def __init__(self, root: str, max_threads=1, disk_budget=500 * 1024 * 1024, shared_cache: SharedCache = None,
+                 timeout=180, parent=None):
+        """
+        :param max_threads: 同時に変換するファイルの数
+        :param disk_budget: キャッシュの PDF の合計がこのバイト数を超えたら先読みしない
+        :param timeout: 1 件の変換の制限時間(秒)
+        """
+        super(Prefetcher, self).__init__(parent)
+        self.root = root
+        self.disk_budget = disk_budget
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self.pending = []
+        self.pending_sheets = {}
+        self.running = {}  # 変換中のファイル -> (Supervisor, シートの選択)
+        self.busy = 0
+        self.max_pending = 20
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.pool.setThreadPriority(QtCore.QThread.Priority.LowestPriority)
+
+    def request(self, book_names: list, sheet_selection: dict):
+        """先読みするファイルを追加する。後から追加したものを先に変換する"""
+        for book_name in reversed(book_names):
+            if book_name in self.pending:
+                self.pending.remove(book_name)
+            if book_name not in self.running:
+                self.pending.insert(0, book_name)
+                self.pending_sheets[book_name] = sheet_selection.get(book_name, None)
+        for book_name in self.pending[self.max_pending:]:
+            del self.pending_sheets[book_name]
+        del self.pending[self.max_pending:]
+        self._schedule()
+
+    @Slot()
+    def pause(self):
+        """本番の変換を始める時に呼ぶ。変換中の先読みはやめさせる"""
+        self.busy += 1
+        for supervisor, _ in self.running.values():
+            supervisor.cancel()
+
+    @Slot()
+    def resume(self):
+        """本番の変換が終わった時に呼ぶ"""
+        self.busy = max(0, self.busy - 1)
+        self._schedule()
+
+    def _schedule(self):
+        while self.busy == 0 and self.pending and len(self.running) < self.pool.maxThreadCount():
+            if cache_size(util.cache_dir()) > self.disk_budget:
+                LOGGER.debug("キャッシュが上限を超えているので先読みしません。")
+                self.pending.clear()
+                self.pending_sheets.clear()
+                return
+            book_name = self.pending.pop(0)
+            sheets = self.pending_sheets.pop(book_name)
+            supervisor = Supervisor(self.timeout, stats_for(util.cache_dir()))
+            self.running[book_name] = (supervisor, sheets)
+            task = PrefetchTask(self.root, book_name, sheets, self.shared_cache, supervisor)
+            task.obj_connection.finished.connect(self.on_finished)
+            self.pool.start(task)
+
+    @Slot(str)
+    def on_finished(self, book_name):
+        supervisor, sheets = self.running.pop(book_name, (None, None))
+        if supervisor is not None and supervisor.cancelled and book_name not in self.pending:
+            # やめさせた先読みは、本番の変換が終わってからやり直す
+            self.pending.insert(0, book_name)
+            self.pending_sheets[book_name] = sheets
+        self._schedule()
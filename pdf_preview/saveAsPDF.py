@@ -4,32 +4,76 @@ import logging
 import os
 import tempfile
 import shutil
+import signal
+import threading
+import uuid
 from typing import Optional
 
 from pathlib import Path, PureWindowsPath
 from contextlib import contextmanager
 
+import pythoncom
+import pywintypes
 import win32com.client
 import win32con
+import win32gui
+import win32process
 import win32ui
 from win32com.universal import com_error
 
+from .fingerprint import FingerprintCache, content_hash
+from .shared_cache import SharedCache, cache_key
+
 LOGGER = logging.getLogger(__name__)
 
 
+def _pid_from_hwnd(hwnd) -> Optional[int]:
+    """ウインドウハンドルからプロセス ID を求める"""
+    try:
+        return win32process.GetWindowThreadProcessId(hwnd)[1]
+    except (pywintypes.error, TypeError):
+        return None
+
+
 class OfficeBase(object):
     def __init__(self, application):
         self.application = application
+        # 変換はワーカースレッドで行うので、そのスレッドで COM を使えるようにしておく。2 回目以降は何もしない
+        pythoncom.CoInitialize()
         self.office = win32com.client.DispatchEx(self.application)
         self.st_mtime = None
+        self.pid = None  # 応答しなくなった時に終了させるためのプロセス ID
+
+    def kill(self) -> bool:
+        """応答しなくなった Office のプロセスを終了する"""
+        if self.pid is None:
+            LOGGER.warning("{} のプロセス ID がわからないので終了できません。".format(self.application))
+            return False
+        LOGGER.warning("{} (pid: {}) を終了します。".format(self.application, self.pid))
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            LOGGER.warning("{} (pid: {}) を終了できませんでした。".format(self.application, self.pid), exc_info=True)
+            return False
+        return True
 
 
 class Word(OfficeBase):
     """PDF変換用MS-Wordクラス"""
     wdExportFormatPDF = 17  # PDF
+    wdExportOptimizeForPrint = 0
+    wdExportOptimizeForOnScreen = 1
+    wdExportCreateNoBookmarks = 0
 
     def __init__(self):
         super(Word, self).__init__("Word.Application")
+        # Word の Application には Hwnd がないので、一意なタイトルでウインドウを探す
+        caption = "pdf-preview-{}".format(uuid.uuid4().hex)
+        try:
+            self.office.Caption = caption
+            self.pid = _pid_from_hwnd(win32gui.FindWindow("OpusApp", caption))
+        except (com_error, pywintypes.error):
+            LOGGER.debug("Word のウインドウが見つかりません。")
 
     @contextmanager
     def _open(self, filename):
@@ -37,17 +81,31 @@ class Word(OfficeBase):
         logging.debug("Document.Open({})".format(filename))
         application = self.office.Documents.Open(
             filename, 0, True, False, "something")
-        yield application
-        application.Saved = True
-        application.Close()
-        del application
-        logging.debug("Document.Close()")
+        try:
+            yield application
+        finally:
+            # タイムアウトで Word を終了させた場合は閉じられないので、元のエラーを優先する
+            try:
+                application.Saved = True
+                application.Close()
+                logging.debug("Document.Close()")
+            except (com_error, pywintypes.error):
+                LOGGER.debug("Document.Close() failed", exc_info=True)
+            del application
 
-    def saveAsPDF(self, filename, tmp_name, select_sheet):
+    def saveAsPDF(self, filename, tmp_name, select_sheet, draft=False):
         assert select_sheet is None
         with self._open(filename) as word:
             logging.debug("ExportAsFixedFormat:{}".format(filename))
-            word.ExportAsFixedFormat(str(PureWindowsPath(tmp_name)), self.wdExportFormatPDF)
+            if draft:
+                # 下書き: 画面表示用に最適化し、文書のプロパティ・構造タグ・しおりを出力しない
+                word.ExportAsFixedFormat(str(PureWindowsPath(tmp_name)), self.wdExportFormatPDF,
+                                         OptimizeFor=self.wdExportOptimizeForOnScreen,
+                                         IncludeDocProps=False,
+                                         CreateBookmarks=self.wdExportCreateNoBookmarks,
+                                         DocStructureTags=False)
+            else:
+                word.ExportAsFixedFormat(str(PureWindowsPath(tmp_name)), self.wdExportFormatPDF)
             return None
 
 
@@ -60,6 +118,7 @@ class Excel(OfficeBase):
     def __init__(self):
         super().__init__("Excel.Application")
         self.office.DisplayAlerts = False
+        self.pid = _pid_from_hwnd(self.office.Hwnd)
 
     @contextmanager
     def _open(self, filename):
@@ -75,24 +134,35 @@ class Excel(OfficeBase):
             - Deletes the temporary file and directory after the workbook is closed.
         """
         temp_dir = tempfile.mkdtemp()
-        tmp_filename = os.path.join(temp_dir, " " + Path(filename).name)
-        shutil.copy2(filename, tmp_filename)
-        LOGGER.debug("copy to %s", tmp_filename)
-        application = self.office.Workbooks.Open(tmp_filename, 0, True)
-        yield application
-        application.Saved = True
-        application.Close()
-        del application
-        os.unlink(tmp_filename)
-        os.rmdir(temp_dir)
-        LOGGER.debug("delete %s", tmp_filename)
-
-
-    def saveAsPDF(self, filename, pdf_filename: str, selected_sheet: dict = None):
+        try:
+            tmp_filename = os.path.join(temp_dir, " " + Path(filename).name)
+            shutil.copy2(filename, tmp_filename)
+            LOGGER.debug("copy to %s", tmp_filename)
+            application = self.office.Workbooks.Open(tmp_filename, 0, True)
+            try:
+                yield application
+            finally:
+                # タイムアウトで Excel を終了させた場合は閉じられないので、元のエラーを優先する
+                try:
+                    application.Saved = True
+                    application.Close()
+                except (com_error, pywintypes.error):
+                    LOGGER.debug("Workbook.Close() failed", exc_info=True)
+                del application
+        finally:
+            # 終了させた Excel がまだファイルを開いている場合は消せないので、エラーにしない
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            LOGGER.debug("delete %s", temp_dir)
+
+
+    def saveAsPDF(self, filename, pdf_filename: str, selected_sheet: dict = None, draft=False):
+        # 下書き: 最小の品質で、文書のプロパティを出力しない
+        quality = self.xlQualityMinimum if draft else self.xlQuality
+        include_doc_properties = not draft
         with self._open(filename) as excel_workbook:
             if selected_sheet is None:
                 # シートを選択したことがない場合には全体を変換する
-                excel_workbook.ExportAsFixedFormat(self.xlTypePDF, pdf_filename, self.xlQuality)
+                excel_workbook.ExportAsFixedFormat(self.xlTypePDF, pdf_filename, quality, include_doc_properties)
             else:
                 # 元のExcelのシートの選択状態とは無関係に、ツールが指定するシートを選択します。
                 # 
@@ -110,20 +180,55 @@ class Excel(OfficeBase):
                             except com_error:
                                 LOGGER.warning("シート名「{}」に対する Select メソッドの実行時時にエラーが発生しました。".format(excel_sheet.name))
                             do_replace = False
-                excel_workbook.ActiveSheet.ExportAsFixedFormat(self.xlTypePDF, pdf_filename, self.xlQuality)
+                excel_workbook.ActiveSheet.ExportAsFixedFormat(self.xlTypePDF, pdf_filename, quality,
+                                                               include_doc_properties)
+
+
+_dst_locks = {}
+_dst_locks_lock = threading.Lock()
+
+
+def _lock_for(dst_path) -> threading.Lock:
+    """変換後の PDF ごとのロックを返す"""
+    with _dst_locks_lock:
+        return _dst_locks.setdefault(str(dst_path), threading.Lock())
 
 
 class Converter(object):
     """Office ドキュメントを PDF に変換する"""
 
     @staticmethod
-    def convert(src_filename: str, selected_sheets: dict = None, force=False, cache_dir=".") -> Optional[str]:
+    def _is_current(src_path: Path, dst_path: Path, src_mtime, fingerprints: FingerprintCache = None) -> bool:
+        """変換済みの PDF が変換元と同じ内容のものかどうか"""
+        if not dst_path.exists():
+            return False
+        if src_mtime == dst_path.stat().st_mtime:
+            LOGGER.debug("same timestamp {}".format(dst_path))
+            return True
+        # タイムスタンプだけが変わった場合（チェックアウトやコピーなど）は内容で比較する
+        # 内容を記録していない PDF の場合は、変換元を読まずに変換し直す
+        converted_from = fingerprints.converted_from(dst_path) if fingerprints is not None else None
+        if converted_from is not None and fingerprints.hash(src_path) == converted_from:
+            LOGGER.debug("same content {}".format(src_path))
+            os.utime(dst_path, (src_mtime, src_mtime))  # 次からはタイムスタンプで判断できる
+            return True
+        return False
+
+    @staticmethod
+    def convert(src_filename: str, selected_sheets: dict = None, force=False, cache_dir=".",
+                fingerprints: FingerprintCache = None, shared_cache: SharedCache = None,
+                on_office=None, draft=False) -> Optional[str]:
         """Office ファイルを PDF に変換する
 
         :param src_filename: 処理対象の Office ドキュメントファイル名
         :param selected_sheets: 印刷対象のシート名（Excelの場合にのみ有効）
         :param force: 変換済みファイルとタイムスタンプが同じ場合でも処理する
         :param dest_dir: 変換後のファイルの配置場所
+        :param fingerprints: 指定した場合、タイムスタンプが違っても内容が同じなら処理しない
+        :param shared_cache: 指定した場合、ローカルにない変換結果を共有キャッシュから探し、変換結果を登録する
+        :param on_office: Office を起動した時に、その OfficeBase を引数にして呼ぶ。応答がない時に終了させるため
+        :param draft: 品質を落として速く変換する。変換結果は通常の品質とは別にキャッシュする。
+                      通常の品質の変換結果が最新の場合は、それを返す
         :return: 変換後のファイル名をフルパス
         """
         LOGGER.info("convert from {}".format(src_filename))
@@ -131,41 +236,80 @@ class Converter(object):
         ext = Path(src_filename).suffix.lower()
 
         # 変換後のファイル名を作成する
-        dst_name = Path(hashlib.md5(str(src_path).encode()).hexdigest()).with_suffix(".pdf")
+        suffix = ".draft.pdf" if draft else ".pdf"
+        digest = Path(hashlib.md5(str(src_path).encode()).hexdigest())
+        dst_name = digest.with_suffix(suffix)
         dst_path = Path(cache_dir) / dst_name
         dst_path.parent.mkdir(exist_ok=True, parents=True)
         LOGGER.debug("convert to {}".format(dst_name))
 
-        # 変換元のファイルの存在を確認する
-        if not src_path.exists():
-            LOGGER.info("not found {}".format(src_filename))
-            return None
+        # 同じ PDF を複数のスレッドで同時に作らない。後から来た方は先の変換結果を使う。
+        with _lock_for(dst_path):
+            # 変換元のファイルの存在を確認する
+            if not src_path.exists():
+                LOGGER.info("not found {}".format(src_filename))
+                return None
 
-        # Excel/Word を開く前にタイムスタンプを保存する
-        src_mtime = src_path.stat().st_mtime
-        # 変換先の PDF のタイムスタンプが同じなら変換しない
-        if dst_path.exists():
-            dst_mtime = Path(dst_path).stat().st_mtime
+            # Excel/Word を開く前にタイムスタンプを保存する
+            src_mtime = src_path.stat().st_mtime
             if not force:
-                if src_mtime == dst_mtime:
-                    LOGGER.debug("same timestamp {}".format(dst_path.stat().st_mtime))
+                # 下書きでも、通常の品質の PDF が最新ならそれを使う(先読み済みのブックはすぐに表示できる)
+                if draft:
+                    full_path = Path(cache_dir) / digest.with_suffix(".pdf")
+                    if Converter._is_current(src_path, full_path, src_mtime, fingerprints):
+                        return full_path
+                # 変換先の PDF のタイムスタンプか内容が同じなら変換しない
+                if Converter._is_current(src_path, dst_path, src_mtime, fingerprints):
                     return dst_path
 
-        if ext in [".pdf"]:
-            shutil.copy2(src_path, dst_path)
-            return dst_path
+            if ext in [".pdf"]:
+                shutil.copy2(src_path, dst_path)
+                return dst_path
 
-        if ext in [".xlsx", ".xls", ".xlsm"]:
-            office = Excel()
-        elif ext in [".docx", ".doc"]:
-            office = Word()
-        else:
-            return None
+            if ext in [".xlsx", ".xls", ".xlsm"]:
+                office_class = Excel
+            elif ext in [".docx", ".doc"]:
+                office_class = Word
+            else:
+                return None
+
+            # 変換する内容のハッシュは Office を開く前に取っておく
+            src_hash = None
+            if fingerprints is not None:
+                src_hash = fingerprints.hash(src_path)
+            elif shared_cache is not None:
+                src_hash = content_hash(src_path)
 
-        # Officeの機能でPDFを作成する
-        office.saveAsPDF(str(src_path), str(dst_path), selected_sheets)
-        os.utime(dst_path, (src_mtime, src_mtime))  # タイムスタンプをコピー
-        return dst_path
+            # ほかの人が同じ内容を変換済みなら、それを使う
+            if shared_cache is not None:
+                key = cache_key(src_hash, selected_sheets, "draft" if draft else "")
+                if shared_cache.fetch(key, dst_path):
+                    os.utime(dst_path, (src_mtime, src_mtime))
+                    if fingerprints is not None:
+                        fingerprints.set_converted(dst_path, src_hash)
+                    return dst_path
+
+            # Officeの機能でPDFを作成する
+            office = office_class()
+            if on_office is not None:
+                on_office(office)
+            # 途中で終了させた場合に壊れた PDF が残らないように、別の名前で作ってから置き換える
+            tmp_path = dst_path.with_name("{}.{}.tmp.pdf".format(dst_path.stem, uuid.uuid4().hex))
+            try:
+                office.saveAsPDF(str(src_path), str(tmp_path), selected_sheets, draft)
+                os.utime(tmp_path, (src_mtime, src_mtime))  # タイムスタンプをコピー
+                os.replace(tmp_path, dst_path)
+            finally:
+                if tmp_path.exists():
+                    try:
+                        tmp_path.unlink()
+                    except OSError:
+                        LOGGER.debug("cannot delete {}".format(tmp_path))
+            if fingerprints is not None:
+                fingerprints.set_converted(dst_path, src_hash)
+            if shared_cache is not None:
+                shared_cache.store(key, dst_path)
+            return dst_path
 
 
 def main(sources):
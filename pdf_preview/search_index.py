@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from . import page_diff, util
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _normalize(text: str) -> str:
+    """検索用に小文字にして空白を取り除く。PDF から取り出した文字列は途中に改行や空白が入るので"""
+    return "".join(text.lower().split())
+
+
+def ngrams(text: str) -> set:
+    """文字の 1-gram と 2-gram。日本語は単語に区切れないので文字単位で索引を作る"""
+    text = _normalize(text)
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def index_path(pdf_path) -> Path:
+    """PDF の全文検索の索引の配置場所。PDF と同じキャッシュのキーで、PDF の隣に置く"""
+    return Path(str(pdf_path) + ".text.json")
+
+
+def _stamp(pdf_path) -> dict:
+    st = os.stat(pdf_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class BookIndex(object):
+    """1 つの PDF の全文検索の索引
+
+    postings: 文字の n-gram -> その n-gram を含むページ番号(0 から)の一覧
+    """
+
+    def __init__(self, pages: list, postings: dict = None):
+        self.pages = pages
+        self.normalized = [_normalize(page) for page in pages]
+        if postings is None:
+            postings = {}
+            for i, page in enumerate(pages):
+                for gram in ngrams(page):
+                    postings.setdefault(gram, []).append(i)
+        self.postings = postings
+
+    def search(self, query: str) -> list:
+        """query を含むページ番号(0 から)の一覧"""
+        q = _normalize(query)
+        if not q:
+            return []
+        grams = ngrams(q)
+        if len(q) > 1:
+            grams = {g for g in grams if len(g) == 2}
+        candidates = None
+        for gram in sorted(grams, key=lambda g: len(self.postings.get(g, []))):
+            pages = set(self.postings.get(gram, []))
+            candidates = pages if candidates is None else candidates & pages
+            if not candidates:
+                return []
+        # n-gram がそろっていても続いているとは限らないので、本文で確かめる
+        return [i for i in sorted(candidates) if q in self.normalized[i]]
+
+    def snippet(self, page: int, query: str, width=30) -> str:
+        """検索結果に表示する、見つかった場所の前後の文字列"""
+        text = " ".join(self.pages[page].split())
+        i = text.lower().find(query.lower().strip())
+        if i < 0:
+            return text[:width * 2]
+        start = max(0, i - width)
+        return text[start:i + len(query) + width]
+
+
+def extract_pages(pdf_path) -> list:
+    """PDF からページごとの文字列を取り出す"""
+    from pypdf import PdfReader
+    reader = PdfReader(str(pdf_path))
+    pages = []
+    for page in reader.pages:
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception:
+            LOGGER.debug("extract_text failed {}".format(pdf_path), exc_info=True)
+            pages.append("")
+    return pages
+
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+MAX_LOADED = 64
+
+
+def load_index(pdf_path) -> BookIndex:
+    """PDF の索引を返す。索引がないか PDF が変わっている場合は作り直して保存する
+
+    読み込んだ索引はメモリにも残しておくので、2 回目からはすぐに返ります。
+    """
+    stamp = _stamp(pdf_path)
+    key = str(pdf_path)
+    with _loaded_lock:
+        entry = _loaded.get(key)
+        if entry is not None and entry[0] == stamp:
+            _loaded.move_to_end(key)
+            return entry[1]
+
+    path = index_path(pdf_path)
+    index = None
+    try:
+        data = util.read_json(path)
+        if data["stamp"] == stamp:
+            index = BookIndex(data["pages"], data["postings"])
+    except (IOError, ValueError, KeyError):
+        pass
+    if index is None:
+        LOGGER.debug("build text index {}".format(pdf_path))
+        index = BookIndex(extract_pages(pdf_path))
+        util.write_json_atomic(path, {"stamp": stamp, "pages": index.pages, "postings": index.postings})
+
+    with _loaded_lock:
+        _loaded[key] = (stamp, index)
+        _loaded.move_to_end(key)
+        while len(_loaded) > MAX_LOADED:
+            _loaded.popitem(last=False)
+    return index
+
+
+def search(pdfs: list, query: str) -> list:
+    """結合した順番の PDF から query を探す
+
+    索引がないブックは索引を作るので、時間がかかることがあります。UI のスレッドでは呼ばないでください。
+
+    :return: (結合した PDF でのページ番号(1 から), 前後の文字列) の一覧
+    """
+    results = []
+    offset = 0
+    for pdf in pdfs:
+        try:
+            index = load_index(pdf)
+        except Exception:
+            LOGGER.warning("索引を読み込めませんでした。このブックは検索しません。:{}".format(pdf), exc_info=True)
+            # 後のブックのページ番号を求めるために、ページ数だけは調べる
+            try:
+                offset += len(page_diff.load_page_hashes(pdf))
+            except Exception:
+                LOGGER.warning("ページ数がわからないので、後のブックは検索しません。:{}".format(pdf), exc_info=True)
+                return results
+            continue
+        for page in index.search(query):
+            results.append((offset + page + 1, index.snippet(page, query)))
+        offset += len(index.pages)
+    return results
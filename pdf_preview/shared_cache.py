@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+LOGGER = logging.getLogger(__name__)
+
+
+def cache_key(src_hash: str, selected_sheets: dict = None, variant: str = "") -> str:
+    """変換元の内容とシートの選択から共有キャッシュのキーを作る
+
+    シートの選択は、選択を外したシートの名前だけを使います。指定がないシートは選択ありの扱いなので。
+    """
+    if selected_sheets is None:
+        unselected = None
+    else:
+        unselected = sorted(name for name, selected in selected_sheets.items() if not selected)
+    key = json.dumps({"hash": src_hash, "unselected": unselected, "variant": variant},
+                     sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class SharedCache(object):
+    """複数の利用者で共有する変換結果のキャッシュ
+
+    ローカルのキャッシュの後ろに置く 2 段目のキャッシュです。
+    PDF は変換元の内容とシートの選択から作ったキーで配置するので、
+    同じ内容のファイルはだれが変換しても同じ PDF になります。
+
+    書き込みはロックファイルで 1 人に限定し、一時ファイルに書いてから名前を変えるので、
+    読む側が書きかけの PDF を見ることはありません。
+    共有フォルダにアクセスできない場合は、ログを残してキャッシュなしで動きます。
+    """
+
+    def __init__(self, directory, stale_lock=3600):
+        """
+        :param directory: 共有キャッシュのディレクトリ
+        :param stale_lock: この秒数より古いロックファイルは、書き込み中に落ちたものとみなして消す。
+                           書き込み中のロックを消さないように、PDF のコピーにかかる時間より十分に長くする
+        """
+        self.directory = Path(directory)
+        self.stale_lock = stale_lock
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / key[:2] / (key + ".pdf")
+
+    def fetch(self, key: str, dst_path) -> bool:
+        """共有キャッシュにあれば dst_path にコピーする
+
+        :return: コピーした場合 True
+        """
+        path = self.path_for(key)
+        dst_path = Path(dst_path)
+        tmp_path = dst_path.with_name(dst_path.name + "." + uuid.uuid4().hex + ".tmp")
+        try:
+            if not path.exists():
+                return False
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, dst_path)
+        except OSError:
+            LOGGER.warning("共有キャッシュから読み込めませんでした。:{}".format(path), exc_info=True)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+        LOGGER.debug("shared cache hit {}".format(path))
+        return True
+
+    def store(self, key: str, src_path) -> bool:
+        """src_path の PDF を共有キャッシュに登録する
+
+        :return: 登録した場合 True。すでにある場合や、ほかの人が書き込み中の場合は False
+        """
+        path = self.path_for(key)
+        lock_path = path.with_suffix(".lock")
+        try:
+            if path.exists():
+                return False
+            path.parent.mkdir(exist_ok=True, parents=True)
+            token = self._lock(lock_path)
+            if token is None:
+                LOGGER.debug("shared cache locked {}".format(lock_path))
+                return False
+            try:
+                # ロックを待つ間にほかの人が書き終えているかもしれない
+                if path.exists():
+                    return False
+                tmp_path = path.with_name(path.name + "." + uuid.uuid4().hex + ".tmp")
+                try:
+                    shutil.copyfile(src_path, tmp_path)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                    raise
+            finally:
+                self._unlock(lock_path, token)
+        except OSError:
+            LOGGER.warning("共有キャッシュに書き込めませんでした。:{}".format(path), exc_info=True)
+            return False
+        LOGGER.debug("shared cache store {}".format(path))
+        return True
+
+    def _lock(self, lock_path: Path) -> Optional[str]:
+        """ロックファイルを作る
+
+        :return: ロックを解除する時に使う、ロックファイルに書いた値。ロックできなかった場合は None
+        """
+        token = uuid.uuid4().hex
+        for retry in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                try:
+                    os.write(fd, token.encode("ascii"))
+                finally:
+                    os.close(fd)
+                return token
+            except FileExistsError:
+                try:
+                    age = time.time() - lock_path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age < self.stale_lock:
+                    return None
+                LOGGER.debug("remove stale lock {}".format(lock_path))
+                try:
+                    os.unlink(lock_path)
+                except FileNotFoundError:
+                    pass
+        return None
+
+    @staticmethod
+    def _unlock(lock_path: Path, token: str):
+        """自分のロックファイルだけを消す。古いとみなされて、ほかの人が作り直したロックは消さない"""
+        try:
+            if lock_path.read_bytes() != token.encode("ascii"):
+                LOGGER.warning("ロックがほかの人に取られていました。:{}".format(lock_path))
+                return
+            os.unlink(lock_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+
+from . import util
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SelectionStore(object):
+    """シート選択の状態を保存するストア
+
+    状態はフォルダごとに 1 つの JSON ファイル(<フォルダ名>.PDF.json)に保存します。
+    ファイルは最初に必要になった時に読み込みます。
+
+    save() はすぐには書き込まず、最後の save() から delay 秒たってから
+    タイマーのスレッドでまとめて書き込みます。UI スレッドはディスクを待ちません。
+    """
+
+    def __init__(self, path, delay=0.5):
+        """
+        :param path: 保存先の JSON ファイル
+        :param delay: 最後の save() から書き込むまでの秒数
+        """
+        self.path = Path(path)
+        self.delay = delay
+        self._data = None
+        self._loaded = False
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def load(self) -> Optional[dict]:
+        """保存した状態を返す。保存したことがない場合は None"""
+        with self._lock:
+            if not self._loaded:
+                self._data = self._read()
+                self._loaded = True
+            return copy.deepcopy(self._data)
+
+    def save(self, data: dict):
+        """状態を保存する。書き込みは後でまとめて行う"""
+        with self._lock:
+            self._data = copy.deepcopy(data)
+            self._loaded = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """書き込み待ちの状態があれば、すぐに書き込む"""
+        # 書き込みの順序が入れ替わらないように、取り出しから書き込みまでを直列化する
+        with self._write_lock:
+            with self._lock:
+                if self._timer is None:
+                    return
+                self._timer.cancel()
+                self._timer = None
+                data = self._data
+            LOGGER.debug("save {}".format(self.path))
+            try:
+                util.write_json_atomic(self.path, data)
+            except OSError:
+                LOGGER.exception("シート選択の状態を保存できませんでした。:{}".format(self.path))
+
+    def _read(self) -> Optional[dict]:
+        try:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except UnicodeDecodeError:
+                # 以前のバージョンが既定のエンコーディングで書いたファイル
+                with open(self.path, "r") as f:
+                    return json.load(f)
+        except IOError:
+            return None
+        except ValueError:
+            LOGGER.warning("シート選択の状態を読み込めませんでした。:{}".format(self.path))
+            return None
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from . import util
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ConversionTimeout(Exception):
+    """変換が制限時間内に終わらなかった"""
+
+
+class ConversionCancelled(Exception):
+    """変換を途中でやめた"""
+
+
+class ConversionStats(object):
+    """ドキュメントごとの変換時間と失敗回数の記録
+
+    タイムアウトの値を調整するために使います。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            self._entries = util.read_json(self.path)
+        except (IOError, ValueError):
+            self._entries = {}
+
+    def record(self, name: str, seconds: float, result: str):
+        """記録を追加する。ファイルには save() で書き込む
+
+        :param name: 変換したドキュメント
+        :param seconds: 変換にかかった秒数
+        :param result: "ok", "failure", "timeout" のいずれか
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.setdefault(name, {"count": 0, "failures": 0, "timeouts": 0,
+                                                    "total_seconds": 0.0, "max_seconds": 0.0})
+            entry["count"] += 1
+            if result == "failure":
+                entry["failures"] += 1
+            elif result == "timeout":
+                entry["timeouts"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["last_seconds"] = seconds
+            entry["last_result"] = result
+            self._dirty = True
+
+    def save(self):
+        """追加した記録をファイルに書き込む"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                util.write_json_atomic(self.path, self._entries)
+                self._dirty = False
+            except OSError:
+                LOGGER.exception("変換の記録を保存できませんでした。:{}".format(self.path))
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            self._load()
+            return json.loads(json.dumps(self._entries.get(name, {})))
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def stats_for(cache_dir) -> ConversionStats:
+    """キャッシュディレクトリごとに 1 つの ConversionStats を返す"""
+    path = Path(cache_dir) / "conversion_stats.json"
+    with _stats_lock:
+        if path not in _stats:
+            _stats[path] = ConversionStats(path)
+        return _stats[path]
+
+
+_hung = {}
+_hung_lock = threading.Lock()
+
+
+def _is_hung(name: str) -> bool:
+    """前に止まったまま終了させられなかった変換がまだ残っているか"""
+    with _hung_lock:
+        worker = _hung.get(name)
+        if worker is not None and not worker.is_alive():
+            del _hung[name]
+            worker = None
+        return worker is not None
+
+
+class Supervisor(object):
+    """変換を監視して、制限時間を過ぎたら Office を終了させる
+
+    Excel が見えないダイアログを出して止まった場合などに、後の変換が待たされ続けないようにします。
+    Office を終了させると、止まっていた COM の呼び出しがエラーになって変換が終わるので、次に進めます。
+    Office を終了させられなかった場合(プロセス ID がわからないなど)は、変換を待つのをやめて次に進みます。
+    キャッシュを使って Office を起動しなかった変換は、監視も記録もしません。
+    """
+
+    def __init__(self, timeout=180, stats: ConversionStats = None, grace=10):
+        """
+        :param timeout: 1 件の変換の制限時間(秒)
+        :param stats: 変換時間と失敗回数の記録先
+        :param grace: Office を終了させてから変換が終わるのを待つ時間(秒)
+        """
+        self.timeout = timeout
+        self.stats = stats
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._running = []
+        self._wakeups = []
+        self._cancelled = False
+
+    def run(self, name: str, fn):
+        """fn(on_office) を別のスレッドで実行して、その結果を返す
+
+        on_office は fn が Office を起動した時に呼ぶ関数です。その時から制限時間を計り、
+        制限時間を過ぎるとその Office を終了させます。終了させてからも grace 秒以内に fn が終わらない場合は、
+        fn を待たずに ConversionTimeout にします。止まったままの fn が残っている間は、同じ name の変換はしません。
+
+        :raise ConversionTimeout: 制限時間内に終わらなかった
+        :raise ConversionCancelled: cancel() で Office を終了させた
+        """
+        if _is_hung(name):
+            LOGGER.error("前の変換が止まったままなので変換しません。:{}".format(name))
+            raise ConversionTimeout(name)
+
+        offices = []
+        timers = []
+        started = []
+        result = {}
+        done = threading.Event()
+        wakeup = threading.Event()  # 終わったか、Office を終了させた
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            LOGGER.error("{} 秒以内に変換が終わりませんでした。:{}".format(self.timeout, name))
+            for office in list(offices):
+                office.kill()
+            wakeup.set()
+
+        def on_office(office):
+            with self._lock:
+                offices.append(office)
+                self._running.append(office)
+                if wakeup not in self._wakeups:
+                    self._wakeups.append(wakeup)
+                cancelled = self._cancelled
+            if cancelled:
+                office.kill()
+                wakeup.set()
+            if not timers:
+                started.append(time.monotonic())
+                timer = threading.Timer(self.timeout, expire)
+                timer.daemon = True
+                timer.start()
+                timers.append(timer)
+
+        def work():
+            try:
+                result["value"] = fn(on_office)
+            except Exception as e:
+                result["error"] = e
+            finally:
+                done.set()
+                wakeup.set()
+
+        worker = threading.Thread(target=work, name="convert", daemon=True)
+        worker.start()
+        try:
+            wakeup.wait()
+            if not done.wait(self.grace):
+                # Office を終了させても COM の呼び出しから戻らない
+                LOGGER.error("変換が終わらないので、待つのをやめます。:{}".format(name))
+                with _hung_lock:
+                    _hung[name] = worker
+        finally:
+            for timer in timers:
+                timer.cancel()
+            with self._lock:
+                if wakeup in self._wakeups:
+                    self._wakeups.remove(wakeup)
+                for office in offices:
+                    self._running.remove(office)
+
+        value = result.get("value")
+        error = result.get("error")
+        if not started:
+            # Office を起動していない
+            if error is not None:
+                raise error
+            return value
+
+        seconds = time.monotonic() - started[0]
+        # 終了させた Office の変換結果は使わない
+        if self._cancelled:
+            raise ConversionCancelled(name)
+        if timed_out.is_set() or not done.is_set():
+            self._record(name, seconds, "timeout")
+            raise ConversionTimeout(name)
+        if error is not None:
+            self._record(name, seconds, "failure")
+            raise error
+        self._record(name, seconds, "ok")
+        return value
+
+    def cancel(self):
+        """変換中の Office を終了させる。以後この Supervisor で起動した Office もすぐに終了させる"""
+        with self._lock:
+            self._cancelled = True
+            running = list(self._running)
+            wakeups = list(self._wakeups)
+        for office in running:
+            office.kill()
+        for wakeup in wakeups:
+            wakeup.set()
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def flush(self):
+        """変換の記録をファイルに書き込む"""
+        if self.stats is not None:
+            self.stats.save()
+
+    def _record(self, name, seconds, result):
+        if self.stats is not None:
+            self.stats.record(name, seconds, result)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from pathlib import Path
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+from PySide6 import QtWidgets
+from PySide6.QtCore import Qt, Slot
+from PySide6.QtPdf import QPdfDocument
+
+from . import page_diff, util
+
+LOGGER = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTH = 160
+
+
+def thumbnail_dir(pdf_path) -> Path:
+    """PDF のサムネイルの配置場所。PDF と同じキャッシュのキーで、PDF の隣に置く"""
+    return Path(str(pdf_path) + ".thumbs")
+
+
+def _stamp(pdf_path) -> dict:
+    st = os.stat(pdf_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "width": THUMBNAIL_WIDTH}
+
+
+def cached_thumbnails(pdf_path):
+    """作成済みのサムネイルのパスの一覧。PDF が変わっていてサムネイルがない場合は None"""
+    directory = thumbnail_dir(pdf_path)
+    try:
+        index = util.read_json(directory / "index.json")
+        if index["stamp"] != _stamp(pdf_path):
+            return None
+    except (IOError, ValueError, KeyError):
+        return None
+    return [directory / name for name in index["pages"]]
+
+
+def thumbnail_name(page_hash: str) -> str:
+    """サムネイルのファイル名。ページの内容のハッシュから決めるので、内容が同じページは同じファイルになる"""
+    return "{}_{}.png".format(page_hash, THUMBNAIL_WIDTH)
+
+
+def render_thumbnails(pdf_path) -> list:
+    """PDF の各ページのサムネイルを作る。作成済みの場合はそれを使う
+
+    PDF が変わった場合も、内容が変わっていないページのサムネイルはそのまま使い、変わったページだけ作ります。
+
+    :return: ページ順のサムネイルの PNG ファイルのパス
+    :raise IOError: PDF を読み込めない
+    """
+    pages = cached_thumbnails(pdf_path)
+    if pages is not None:
+        return pages
+
+    stamp = _stamp(pdf_path)
+    directory = thumbnail_dir(pdf_path)
+    directory.mkdir(parents=True, exist_ok=True)
+    names = [thumbnail_name(h) for h in page_diff.load_page_hashes(pdf_path)]
+    missing = [i for i, name in enumerate(names) if not (directory / name).exists()]
+    LOGGER.debug("render thumbnails {} ({}/{} pages)".format(pdf_path, len(missing), len(names)))
+
+    if missing:
+        document = QPdfDocument()
+        error = document.load(str(pdf_path))
+        if error != QPdfDocument.Error.None_:
+            raise IOError("PDF を読み込めませんでした。({}):{}".format(error, pdf_path))
+        for i in missing:
+            size = document.pagePointSize(i)
+            height = int(THUMBNAIL_WIDTH * size.height() / size.width()) if size.width() > 0 else THUMBNAIL_WIDTH
+            image = document.render(i, QtCore.QSize(THUMBNAIL_WIDTH, max(1, height)))
+            image.save(str(directory / names[i]))
+        document.close()
+
+    # 使わなくなったサムネイルを削除する
+    for path in directory.glob("*.png"):
+        if path.name not in names:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    util.write_json_atomic(directory / "index.json", {"stamp": stamp, "pages": names})
+    return [directory / name for name in names]
+
+
+class ThumbnailSignal(QtCore.QObject):
+    ready = QtCore.Signal(list, int)  # サムネイルのパス(作れなかったページは空文字列), 変換の世代
+
+
+class ThumbnailTask(QtCore.QRunnable):
+    """ブックごとの PDF のサムネイルを作り、結合した順番に並べて通知する
+
+    サムネイルを作れなかったブックは、ページ数分の空文字列を入れて、後のブックのページ番号がずれないようにします。
+    """
+
+    def __init__(self, pdfs: list, generation=0):
+        super(ThumbnailTask, self).__init__()
+        self.pdfs = pdfs
+        self.generation = generation
+        self.obj_connection = ThumbnailSignal()
+
+    def run(self):
+        thumbnails = []
+        for pdf in self.pdfs:
+            try:
+                thumbnails.extend(str(p) for p in render_thumbnails(pdf))
+            except Exception:
+                LOGGER.warning("サムネイルを作れませんでした。:{}".format(pdf), exc_info=True)
+                try:
+                    thumbnails.extend("" for _ in page_diff.load_page_hashes(pdf))
+                except Exception:
+                    LOGGER.warning("ページ数がわからないので、後のブックのサムネイルは表示しません。:{}".format(pdf),
+                                   exc_info=True)
+                    break
+        self.obj_connection.ready.emit(thumbnails, self.generation)
+
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+    """サムネイルの一覧。画像は表示する時に読み込む"""
+
+    def __init__(self, parent=None):
+        super(ThumbnailModel, self).__init__(parent)
+        self.paths = []
+
+    def setPaths(self, paths: list):
+        self.beginResetModel()
+        # ファイル名はページの内容ごとに違うので、読み込み済みの画像はそのまま使える
+        self.paths = paths
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return str(index.row() + 1)
+        if role == Qt.ItemDataRole.DecorationRole:
+            path = self.paths[index.row()]
+            if not path:
+                # サムネイルを作れなかったページはページ番号だけ表示する
+                return None
+            pixmap = QtGui.QPixmapCache.find(path)
+            if pixmap is None or pixmap.isNull():
+                pixmap = QtGui.QPixmap(path)
+                QtGui.QPixmapCache.insert(path, pixmap)
+            return pixmap
+        return None
+
+
+class ThumbnailView(QtWidgets.QListView):
+    """結合した PDF のページのサムネイルを並べるパネル
+
+    signal: pageClicked(page: int) page: 1 から始まるページ番号
+    """
+    pageClicked = QtCore.Signal(int)
+
+    def __init__(self, parent=None):
+        super(ThumbnailView, self).__init__(parent)
+        self.thumbnail_model = ThumbnailModel(self)
+        self.setModel(self.thumbnail_model)
+        self.setIconSize(QtCore.QSize(THUMBNAIL_WIDTH, int(THUMBNAIL_WIDTH * 1.5)))
+        self.setUniformItemSizes(True)
+        self.setSpacing(4)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.clicked.connect(self.on_clicked)
+
+    def setThumbnails(self, paths: list):
+        self.thumbnail_model.setPaths(paths)
+
+    @Slot(QtCore.QModelIndex)
+    def on_clicked(self, index):
+        self.pageClicked.emit(index.row() + 1)
@@ -1,6 +1,10 @@
+import json
 import os
+import tempfile
 from pathlib import Path
 
+OFFICE_SUFFIXES = (".xls", ".xlsx", ".xlsm", ".doc", ".docx")
+
 def get_pdfjs():
     if not Path("pdfjs-dist.zip").exists():
         import urllib.request
@@ -18,4 +22,29 @@ def cache_dir() -> Path:
 
 def log_dir() -> Path:
     log_dir = os.path.expandvars(r'$LOCALAPPDATA\pdf-preview\log')
-    return Path(log_dir)
\ No newline at end of file
+    return Path(log_dir)
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_json_atomic(path, data):
+    """JSON をファイルに書き込む
+
+    一時ファイルに書き込んでから置き換えるので、途中で落ちても書きかけのファイルは残りません。
+    """
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=path.name, suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""フォルダを監視して、変換結果のキャッシュを最新に保つ
+
+    py -m pdf_preview --watch <directory>
+
+GUI なしで動きます。フォルダ以下のドキュメントが変更されたら変換し直し、
+シート選択の状態(.PDF.json)を保存してあるフォルダは結合した PDF も作り直します。
+GUI でそのフォルダを開いた時には、変換済みの PDF がそのまま表示されます。
+"""
+import argparse
+import logging
+import os
+import time
+from pathlib import Path
+
+from . import pipeline, search_index, util
+from .shared_cache import SharedCache
+from .state_store import SelectionStore
+from .supervisor import Supervisor, stats_for
+
+LOGGER = logging.getLogger(__name__)
+
+
+def scan(root) -> tuple:
+    """フォルダ以下を調べる
+
+    :return: (Office ドキュメントの相対パス -> (サイズ, 更新日時), フォルダのパスの一覧)
+    """
+    files = {}
+    folders = [Path(root)]
+    i = 0
+    while i < len(folders):
+        folder = folders[i]
+        i += 1
+        try:
+            with os.scandir(folder) as it:
+                for e in it:
+                    try:
+                        if e.is_dir():
+                            folders.append(Path(e.path))
+                        elif e.name.lower().endswith(util.OFFICE_SUFFIXES) and not e.name.startswith("~$"):
+                            st = e.stat()
+                            files[str(Path(e.path).relative_to(root))] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            LOGGER.debug("scan failed {}".format(folder))
+    return files, folders
+
+
+class FolderWatcher(object):
+    """フォルダ以下を定期的に調べて、変更されたドキュメントを変換する"""
+
+    def __init__(self, root, max_workers=2, shared_cache: SharedCache = None, convert_all=False, timeout=180):
+        """
+        :param root: 監視するフォルダ
+        :param max_workers: 同時に変換するドキュメントの数
+        :param convert_all: 選択されていないドキュメントも変換する
+        :param timeout: 1 件の変換の制限時間(秒)
+        """
+        # GUI と同じキャッシュのファイル名になるように、resolve ではなく absolute を使う
+        self.root = Path(root).absolute()
+        self.max_workers = max_workers
+        self.shared_cache = shared_cache
+        self.convert_all = convert_all
+        self.supervisor = Supervisor(timeout, stats_for(util.cache_dir()))
+        self.files = None
+
+    def poll(self):
+        """1 回分の監視。前回から変わったものを変換する"""
+        files, folders = scan(self.root)
+        if self.files is None:
+            changed = set(files)
+        else:
+            changed = {f for f, stat in files.items() if self.files.get(f) != stat}
+        self.files = files
+        if changed:
+            LOGGER.info("changed {} files".format(len(changed)))
+
+        selected = set()
+        for folder in folders:
+            output_path = pipeline.folder_output_path(folder)
+            state_file = pipeline.state_path(output_path)
+            if not state_file.exists():
+                continue
+            state = SelectionStore(state_file).load()
+            if not state:
+                continue
+            if not pipeline.state_belongs_to(state, folder):
+                # 同じ名前の別のフォルダの状態
+                continue
+            books = state.get("files", [])
+            sheets = state.get("sheets", {})
+            prefix = folder.relative_to(self.root)
+            selected.update(str(prefix / b) for b in books)
+
+            # 毎回すべてのブックを確認する。変換済みのブックはタイムスタンプか内容のハッシュで、
+            # 結合済みの PDF は結合した PDF の一覧で判断して、変わっていなければ何もしない。
+            # GUI が古いキャッシュを削除した場合も、ここで作り直す。
+            pdfs = pipeline.convert_books(folder, books, sheets, (), self.shared_cache, self.max_workers,
+                                          self.supervisor)
+            pipeline.merge_pdfs(pdfs, output_path)
+            # 全文検索の索引も作っておく。作成済みならすぐに終わる
+            for pdf in pdfs:
+                try:
+                    search_index.load_index(pdf)
+                except Exception:
+                    LOGGER.warning("索引を作れませんでした。:{}".format(pdf), exc_info=True)
+
+        if self.convert_all:
+            rest = sorted(changed - selected)
+            if rest:
+                pipeline.convert_books(self.root, rest, {}, (), self.shared_cache, self.max_workers,
+                                       self.supervisor)
+
+    def run(self, interval=5.0):
+        LOGGER.info("watch {}".format(self.root))
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                LOGGER.exception("監視中にエラーが発生しました。")
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pdf_preview --watch")
+    parser.add_argument("directory")
+    parser.add_argument("--interval", type=float, default=5.0, help="フォルダを調べる間隔(秒)")
+    parser.add_argument("--workers", type=int, default=2, help="同時に変換するドキュメントの数")
+    parser.add_argument("--all", action="store_true", default=False,
+                        help="選択されていないドキュメントも変換する")
+    parser.add_argument("--shared-cache", default=os.environ.get("PDF_PREVIEW_SHARED_CACHE"),
+                        help="変換結果を共有するキャッシュのディレクトリ")
+    parser.add_argument("--timeout", type=int, default=180, help="1 件の変換の制限時間(秒)")
+    args = parser.parse_args(argv)
+
+    shared_cache = SharedCache(args.shared_cache) if args.shared_cache else None
+    os.makedirs(util.cache_dir(), exist_ok=True)
+    watcher = FolderWatcher(args.directory, args.workers, shared_cache, args.all, args.timeout)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        LOGGER.info("stop")
@@ -0,0 +1,115 @@
+import threading
+
+from pdf_preview import conversion
+from pdf_preview.conversion import ConversionState, ConvertThread
+
+
+def test_generation_and_force():
+    state = ConversionState()
+    state.start(["a.xlsx", "b.xlsx"], ["a.xlsx"])
+    first_event = state.cancel_event
+    assert state.generation == 1
+    assert state.pending_force == ["a.xlsx"]
+
+    # 並べ替えで新しい変換を依頼しても、a.xlsx は変換し直す対象に残る
+    state.start(["b.xlsx", "a.xlsx"])
+    assert first_event.is_set()
+    assert not state.cancel_event.is_set()
+    assert state.pending_force == ["a.xlsx"]
+
+    # 古い世代の結果は表示しない
+    assert not state.merged(1, True)
+    assert not state.full_ready
+    assert state.merged(2, False)
+    assert state.pending_force == ["a.xlsx"]
+    assert state.merged(2, True)
+    assert state.full_ready
+    assert state.pending_force == []
+
+
+def test_save_waits_for_full_quality():
+    state = ConversionState()
+    state.start(["a.xlsx"])
+    assert not state.request_save()
+    assert not state.take_save_request()
+    state.merged(1, False)
+    assert not state.take_save_request()
+    state.merged(1, True)
+    assert state.take_save_request()
+    assert not state.take_save_request()
+    assert state.request_save()
+
+
+def test_display(tmp_path):
+    output = tmp_path / "out.PDF"
+    draft = tmp_path / "out.draft.PDF"
+    state = ConversionState(output)
+    # 前回と同じ PDF を開き直した場合も、まだ何も表示していなければ読み込む
+    assert state.display(output, ["a", "b"], loaded=False) is None
+    assert state.display(output, ["a", "b"]) == []
+    assert state.display(draft, ["a", "x"]) == [[2, 2]]
+    # ページが同じでもファイルが変われば読み込み直す
+    assert state.display(output, ["a", "x"]) is None
+    assert state.viewer_path == output
+    # ハッシュが分からない場合は読み込み直す
+    assert state.display(output, None) is None
+    assert state.display(output, ["a", "x"]) is None
+    assert state.display(output, ["a", "x", "c"]) == [[3, 3]]
+
+
+def run_thread(monkeypatch, tmp_path, draft, cancel_event):
+    calls = []
+
+    def convert_books(root, books, sheets, force, *args, draft=False, **kwargs):
+        calls.append(("convert", list(force), draft))
+        return ["{}.pdf".format(b) for b in books]
+
+    def merge_pdfs(pdfs, output):
+        calls.append(("merge", str(output)))
+
+    monkeypatch.setattr(conversion.util, "cache_dir", lambda: tmp_path)
+    monkeypatch.setattr(conversion.pipeline, "purge_cache", lambda cache_dir: None)
+    monkeypatch.setattr(conversion.pipeline, "convert_books", convert_books)
+    monkeypatch.setattr(conversion.pipeline, "merge_pdfs", merge_pdfs)
+    monkeypatch.setattr(conversion.page_diff, "merged_page_hashes", lambda pdfs: ["h"] * len(pdfs))
+
+    merged = []
+    thread = ConvertThread(str(tmp_path), tmp_path / "out.PDF", ["a.xlsx"], ["a.xlsx"], {}, draft=draft,
+                           generation=3, cancel_event=cancel_event)
+    thread.obj_connection.merged.connect(lambda path, pdfs, generation, full, pages:
+                                         merged.append((path, generation, full)))
+    thread.run()
+    return calls, merged
+
+
+def test_convert_thread_draft(monkeypatch, tmp_path, qapp):
+    calls, merged = run_thread(monkeypatch, tmp_path, True, threading.Event())
+    assert calls == [("convert", ["a.xlsx"], True), ("merge", str(tmp_path / "out.draft.PDF")),
+                     ("convert", ["a.xlsx"], False), ("merge", str(tmp_path / "out.PDF"))]
+    assert merged == [(str(tmp_path / "out.draft.PDF"), 3, False), (str(tmp_path / "out.PDF"), 3, True)]
+
+
+def test_convert_thread_cancelled(monkeypatch, tmp_path, qapp):
+    # 新しい変換を依頼されていたら、通常の品質の変換はしない
+    cancel_event = threading.Event()
+    cancel_event.set()
+    calls, merged = run_thread(monkeypatch, tmp_path, True, cancel_event)
+    assert [c[0] for c in calls] == ["convert", "merge"]
+    assert merged == [(str(tmp_path / "out.draft.PDF"), 3, False)]
+
+
+def test_convert_thread_finishes_after_error(monkeypatch, tmp_path, qapp):
+    def merge_pdfs(pdfs, output):
+        raise OSError("locked")
+
+    monkeypatch.setattr(conversion.util, "cache_dir", lambda: tmp_path)
+    monkeypatch.setattr(conversion.pipeline, "purge_cache", lambda cache_dir: None)
+    monkeypatch.setattr(conversion.pipeline, "convert_books", lambda *args, **kwargs: [])
+    monkeypatch.setattr(conversion.pipeline, "merge_pdfs", merge_pdfs)
+
+    # エラーになっても threadFinished を通知して、先読みを再開させる
+    finished = []
+    thread = ConvertThread(str(tmp_path), tmp_path / "out.PDF", ["a.xlsx"], [], {})
+    thread.obj_connection.threadFinished.connect(lambda: finished.append(True))
+    thread.run()
+    assert finished == [True]
@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+
+from pdf_preview.dirindex import DirectoryIndex
+
+
+def make_tree(root):
+    (root / "docs" / "old").mkdir(parents=True)
+    (root / "empty" / "deep").mkdir(parents=True)
+    (root / "a.xlsx").write_bytes(b"a")
+    (root / "~$a.xlsx").write_bytes(b"lock")
+    (root / "note.txt").write_bytes(b"n")
+    (root / "docs" / "b.docx").write_bytes(b"bb")
+    (root / "empty" / "deep" / "c.txt").write_bytes(b"c")
+
+
+def test_scan(tmp_path):
+    root = tmp_path / "root"
+    make_tree(root)
+    index = DirectoryIndex(root)
+    changed = []
+    index.scan(changed.append)
+
+    top = index.listing("")
+    assert top["dirs"] == ["docs", "empty"]
+    assert [f[0] for f in top["files"]] == ["a.xlsx"]
+    assert top["files"][0][1] == 1
+    assert index.listing("docs")["files"][0][0] == "b.docx"
+    assert sorted(changed) == sorted(["", "docs", str(Path("docs") / "old"), "empty",
+                                      str(Path("empty") / "deep")])
+
+    # Office ドキュメントがあるかどうか
+    assert index.has_docs("") is True
+    assert index.has_docs("docs") is True
+    assert index.has_docs(str(Path("docs") / "old")) is False
+    assert index.has_docs("empty") is False
+
+
+def test_revalidate(tmp_path):
+    root = tmp_path / "root"
+    make_tree(root)
+    cache_path = tmp_path / "cache" / "index.json"
+    index = DirectoryIndex(root, cache_path)
+    index.scan()
+    assert cache_path.exists()
+
+    # 保存した一覧を読み込むと、変わっていないフォルダは読み直さない
+    index = DirectoryIndex(root, cache_path)
+    index.load()
+    assert index.listing("docs") is not None
+    changed = []
+    index.scan(changed.append)
+    assert changed == []
+
+    # ファイルを追加したフォルダだけ読み直す
+    (root / "empty" / "deep" / "d.xls").write_bytes(b"d")
+    changed = []
+    index.scan(changed.append)
+    assert changed == [str(Path("empty") / "deep")]
+    assert index.has_docs("empty") is True
+
+    # なくなったフォルダは一覧から消える
+    os.unlink(root / "docs" / "b.docx")
+    os.rmdir(root / "docs" / "old")
+    index.scan()
+    assert index.listing(str(Path("docs") / "old")) is None
+    assert index.has_docs("docs") is False
+
+
+def test_load_other_root(tmp_path):
+    root = tmp_path / "root"
+    make_tree(root)
+    cache_path = tmp_path / "index.json"
+    DirectoryIndex(root, cache_path).scan()
+
+    index = DirectoryIndex(tmp_path, cache_path)
+    index.load()
+    assert index.listing("") is None
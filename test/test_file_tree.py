@@ -0,0 +1,76 @@
+import os
+
+from PySide6 import QtCore, QtWidgets
+from PySide6.QtCore import Qt
+from PySide6.QtTest import QAbstractItemModelTester
+from pytestqt.qtbot import QtBot
+
+from pdf_preview.file_tree import CheckableDirectoryModel
+
+
+def names(model, parent=QtCore.QModelIndex()):
+    return [model.index(row, 0, parent).data() for row in range(model.rowCount(parent))]
+
+
+def test_model(tmp_path, qtbot: QtBot, qtlog, qapp):
+    root = tmp_path / "root"
+    (root / "docs" / "sub").mkdir(parents=True)
+    (root / "empty").mkdir()
+    (root / "a.xlsx").write_bytes(b"a")
+    (root / "docs" / "b.docx").write_bytes(b"bb")
+    (root / "empty" / "c.txt").write_bytes(b"c")
+
+    book_list = QtWidgets.QListWidget()
+    book_list.addItem("a.xlsx")
+    model = CheckableDirectoryModel(cache_dir=tmp_path / "cache", interval=0.1)
+    model.setBookListWidget(book_list)
+    try:
+        model.setRootPath(root)
+        # 変更のたびにモデルの整合性を調べる。問題があれば警告が出る
+        tester = QAbstractItemModelTester(model, QAbstractItemModelTester.FailureReportingMode.Warning)
+
+        # Office ドキュメントがないフォルダは表示しない
+        qtbot.waitUntil(lambda: names(model) == ["docs", "a.xlsx"], timeout=5000)
+        a = model.index(1, 0)
+        assert model.data(a, Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked
+        assert model.filePath(a) == str(root / "a.xlsx")
+
+        docs = model.index(0, 0)
+        if model.canFetchMore(docs):
+            model.fetchMore(docs)
+        qtbot.waitUntil(lambda: names(model, model.index(0, 0)) == ["b.docx"], timeout=5000)
+        assert model.relativePath(model.index(0, 0, model.index(0, 0))) == os.path.join("docs", "b.docx")
+
+        # 追加・削除したファイルを表示に反映する。Office ドキュメントがなくなったフォルダは消える
+        (root / "new.xlsx").write_bytes(b"n")
+        (root / "docs" / "b.docx").unlink()
+        qtbot.waitUntil(lambda: names(model) == ["a.xlsx", "new.xlsx"], timeout=5000)
+        assert "docs" not in model.dir_nodes
+        assert model.data(model.index(1, 0), Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Unchecked
+        del tester
+    finally:
+        model.stopScanner()
+
+    assert [r.message for r in qtlog.records if "FAIL!" in r.message] == []
+
+
+def test_empty_root(tmp_path, qtbot: QtBot, qtlog, qapp):
+    root = tmp_path / "root"
+    (root / "empty").mkdir(parents=True)
+    (root / "note.txt").write_bytes(b"n")
+
+    model = CheckableDirectoryModel(cache_dir=tmp_path / "cache", interval=0.1)
+    model.setBookListWidget(QtWidgets.QListWidget())
+    try:
+        model.setRootPath(root)
+        tester = QAbstractItemModelTester(model, QAbstractItemModelTester.FailureReportingMode.Warning)
+        with qtbot.waitSignal(model.scanner.scanFinished, timeout=5000):
+            pass
+        qtbot.waitUntil(lambda: model.root_node.children == [], timeout=5000)
+        assert model.rowCount() == 0
+        assert not model.hasChildren()
+        del tester
+    finally:
+        model.stopScanner()
+
+    assert [r.message for r in qtlog.records if "FAIL!" in r.message] == []
@@ -0,0 +1,38 @@
+import os
+
+from pdf_preview.fingerprint import FingerprintCache
+
+
+def test_hash_is_cached(tmp_path, monkeypatch):
+    src = tmp_path / "book.xlsx"
+    src.write_bytes(b"content")
+    cache = FingerprintCache(tmp_path / "fingerprints.json")
+    digest = cache.hash(src)
+
+    calls = []
+    monkeypatch.setattr("pdf_preview.fingerprint.content_hash", lambda p: calls.append(p) or "x")
+    assert cache.hash(src) == digest
+    assert calls == []
+
+    # タイムスタンプが変われば計算し直す
+    st = src.stat()
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.hash(src) == "x"
+    assert len(calls) == 1
+
+
+def test_converted_is_saved(tmp_path):
+    src = tmp_path / "book.xlsx"
+    src.write_bytes(b"content")
+    dst = tmp_path / "book.pdf"
+    dst.write_bytes(b"pdf")
+    cache = FingerprintCache(tmp_path / "fingerprints.json")
+    cache.set_converted(dst, cache.hash(src))
+    cache.save()
+
+    loaded = FingerprintCache(tmp_path / "fingerprints.json")
+    assert loaded.converted_from(dst) == loaded.hash(src)
+
+    dst.unlink()
+    loaded.prune()
+    assert loaded.converted_from(dst) is None
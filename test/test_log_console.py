@@ -0,0 +1,29 @@
+import logging
+
+from pdf_preview.log_console import LogConsole
+from pytestqt.plugin import QtBot
+
+
+def test_flush_in_batch(qtbot: QtBot, qapp):
+    console = LogConsole(max_lines=100, capacity=50)
+    qtbot.addWidget(console)
+    console.timer.stop()
+    logger = logging.getLogger("test_log_console")
+    logger.addHandler(console.handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        for i in range(1000):
+            logger.debug("message %d", i)
+    finally:
+        logger.removeHandler(console.handler)
+
+    console.flush()
+    lines = console.toPlainText().splitlines()
+    # あふれた分は件数だけを表示し、最新のレコードは残る
+    assert lines[0] == "... 950 件のログを省略しました ..."
+    assert lines[-1] == "message 999"
+    assert len(lines) == 51
+
+    # バッファは空になっている
+    console.flush()
+    assert len(console.toPlainText().splitlines()) == 51
@@ -0,0 +1,42 @@
+from pdf_preview.page_diff import changed_pages, load_page_hashes, merged_page_hashes, pages_path
+
+
+def test_changed_pages():
+    assert changed_pages(["a", "b", "c"], ["a", "b", "c"]) == []
+    assert changed_pages(["a", "b", "c", "d"], ["a", "x", "c", "y"]) == [[2, 2], [4, 4]]
+    assert changed_pages(["a", "b", "c", "d"], ["x", "y", "c", "d"]) == [[1, 2]]
+    # ページの挿入
+    assert changed_pages(["a", "b", "c"], ["a", "x", "y", "b", "c"]) == [[2, 3]]
+    # ページの削除
+    assert changed_pages(["a", "b", "c"], ["a", "c"]) == [[2, 2]]
+    assert changed_pages(["a", "b", "c"], ["a", "b"]) == [[2, 2]]
+    assert changed_pages(["a"], []) == []
+
+
+def write_pdf(path, sizes):
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for width, height in sizes:
+        writer.add_blank_page(width=width, height=height)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def test_merged_page_hashes(tmp_path):
+    book1 = tmp_path / "book1.pdf"
+    book2 = tmp_path / "book2.pdf"
+    write_pdf(book1, [(200, 300), (300, 200)])
+    write_pdf(book2, [(200, 300)])
+
+    hashes = load_page_hashes(book1)
+    assert len(hashes) == 2
+    assert hashes[0] != hashes[1]
+    assert pages_path(book1).exists()
+
+    old = merged_page_hashes([book1, book2])
+    assert old == hashes + load_page_hashes(book2)
+    assert changed_pages(old, merged_page_hashes([book1, book2])) == []
+
+    # 2 冊目のページが変わると、結合した PDF での 3 ページ目が変わる
+    write_pdf(book2, [(400, 300)])
+    assert changed_pages(old, merged_page_hashes([book1, book2])) == [[3, 3]]
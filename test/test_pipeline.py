@@ -0,0 +1,64 @@
+import os
+
+from pypdf import PdfReader, PdfWriter
+
+from pdf_preview import pipeline
+
+
+def make_pdf(path, pages):
+    writer = PdfWriter()
+    for i in range(pages):
+        writer.add_blank_page(width=100, height=100)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def test_merge_is_skipped_when_unchanged(tmp_path):
+    a = make_pdf(tmp_path / "a.pdf", 1)
+    b = make_pdf(tmp_path / "b.pdf", 2)
+    output = tmp_path / "folder.PDF"
+
+    pipeline.merge_pdfs([a, b], output)
+    assert len(PdfReader(output).pages) == 3
+
+    os.utime(output, ns=(0, 0))
+    pipeline.merge_pdfs([a, b], output)
+    assert output.stat().st_mtime_ns == 0
+
+    # 順番が変わったら結合し直す
+    pipeline.merge_pdfs([b], output)
+    assert len(PdfReader(output).pages) == 2
+
+
+def test_merge_replaces_output(tmp_path):
+    a = make_pdf(tmp_path / "a.pdf", 1)
+    output = tmp_path / "folder.PDF"
+    pipeline.merge_pdfs([a], output)
+
+    # 結合に失敗した場合は前の PDF がそのまま残り、一時ファイルは残らない
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    try:
+        pipeline.merge_pdfs([a, broken], output)
+    except Exception:
+        pass
+    assert len(PdfReader(output).pages) == 1
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_state_belongs_to(tmp_path):
+    a = tmp_path / "2023" / "report"
+    b = tmp_path / "2024" / "report"
+    a.mkdir(parents=True)
+    b.mkdir(parents=True)
+    (a / "x.xlsx").write_bytes(b"")
+
+    state = {"files": ["x.xlsx"], "sheets": {}, "folder": str(a)}
+    assert pipeline.state_belongs_to(state, a)
+    assert not pipeline.state_belongs_to(state, b)
+
+    # フォルダのパスを保存していない状態は、ブックがあるかどうかで判断する
+    legacy = {"files": ["x.xlsx"], "sheets": {}}
+    assert pipeline.state_belongs_to(legacy, a)
+    assert not pipeline.state_belongs_to(legacy, b)
@@ -0,0 +1,62 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from pdf_preview.prefetch import Prefetcher, neighbors, cache_size
+from pdf_preview.supervisor import ConversionCancelled, Supervisor
+
+
+def test_neighbors(tmp_path):
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    for name in ["a.xlsx", "b.docx", "c.txt", "d.xls", "e.xlsm", "f.doc"]:
+        (sub / name).write_bytes(b"")
+
+    assert neighbors(tmp_path, str(Path("sub") / "d.xls")) == \
+        [str(Path("sub") / n) for n in ["a.xlsx", "b.docx", "e.xlsm", "f.doc"]]
+    assert neighbors(tmp_path, str(Path("sub") / "a.xlsx"), count=1) == [str(Path("sub") / "b.docx")]
+    assert neighbors(tmp_path, "missing.xlsx") == []
+
+
+def test_cache_size(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"12345")
+    (tmp_path / "a.PDF.json").write_bytes(b"123")
+    assert cache_size(tmp_path) == 5
+
+
+class FakeOffice(object):
+    def __init__(self):
+        self.killed = threading.Event()
+
+    def kill(self):
+        self.killed.set()
+        return True
+
+
+def test_pause_cancels_running_prefetch(tmp_path, qapp):
+    prefetcher = Prefetcher(str(tmp_path))
+    supervisor = Supervisor(10)
+    prefetcher.running["a.xlsx"] = (supervisor, {"Sheet1": True})
+
+    office = FakeOffice()
+    launched = threading.Event()
+
+    def hang(on_office):
+        on_office(office)
+        launched.set()
+        office.killed.wait(10)
+
+    thread = threading.Thread(target=lambda: pytest.raises(ConversionCancelled, supervisor.run, "a.xlsx", hang))
+    thread.start()
+    assert launched.wait(5)
+
+    prefetcher.pause()
+    thread.join(5)
+    assert office.killed.is_set()
+
+    # やめさせた先読みは、本番の変換が終わるまで待たせる
+    prefetcher.on_finished("a.xlsx")
+    assert prefetcher.pending == ["a.xlsx"]
+    assert prefetcher.pending_sheets["a.xlsx"] == {"Sheet1": True}
+    assert prefetcher.running == {}
@@ -0,0 +1,43 @@
+from pdf_preview import search_index
+from pdf_preview.search_index import BookIndex, ngrams
+
+
+def test_ngrams():
+    assert ngrams("Ab c") == {"a", "b", "c", "ab", "bc"}
+
+
+def test_search():
+    index = BookIndex(["売上 集計表\n2024年度", "Hello World", "集計\n表の説明"])
+    assert index.search("集計表") == [0, 2]
+    assert index.search("hello") == [1]
+    assert index.search("world hello") == []
+    assert index.search("年") == [0]
+    assert index.search("  ") == []
+    assert index.snippet(1, "world") == "Hello World"
+
+
+def test_postings_are_reused():
+    index = BookIndex(["abc", "bcd"])
+    loaded = BookIndex(index.pages, index.postings)
+    assert loaded.search("bc") == [0, 1]
+    assert loaded.search("cd") == [1]
+
+
+def test_search_skips_failed_book(monkeypatch):
+    indexes = {"a.pdf": BookIndex(["集計", "x"]), "c.pdf": BookIndex(["y", "集計表"])}
+
+    def load_index(pdf):
+        if pdf not in indexes:
+            raise ValueError(pdf)
+        return indexes[pdf]
+
+    monkeypatch.setattr(search_index, "load_index", load_index)
+    monkeypatch.setattr(search_index.page_diff, "load_page_hashes", lambda pdf: ["h"] * 3)
+    # 索引を読めないブックがあっても、後のブックは正しいページ番号で探す
+    assert [r[0] for r in search_index.search(["a.pdf", "b.pdf", "c.pdf"], "集計")] == [1, 7]
+
+    def broken(pdf):
+        raise IOError(pdf)
+
+    monkeypatch.setattr(search_index.page_diff, "load_page_hashes", broken)
+    assert [r[0] for r in search_index.search(["a.pdf", "b.pdf", "c.pdf"], "集計")] == [1]
@@ -0,0 +1,73 @@
+from pdf_preview.shared_cache import SharedCache, cache_key
+
+
+def test_cache_key():
+    assert cache_key("abc", None) != cache_key("abc", {})
+    # 選択ありのシートは指定がない場合と同じ扱い
+    assert cache_key("abc", {"Sheet1": True, "Sheet2": False}) == cache_key("abc", {"Sheet2": False})
+    assert cache_key("abc", {"Sheet2": False}) != cache_key("abd", {"Sheet2": False})
+
+
+def test_store_and_fetch(tmp_path):
+    cache = SharedCache(tmp_path / "shared")
+    src = tmp_path / "src.pdf"
+    src.write_bytes(b"%PDF-1.4")
+    dst = tmp_path / "local" / "dst.pdf"
+    dst.parent.mkdir()
+    key = cache_key("abc")
+
+    assert not cache.fetch(key, dst)
+    assert cache.store(key, src)
+    assert not cache.store(key, src)  # 登録済み
+    assert cache.fetch(key, dst)
+    assert dst.read_bytes() == b"%PDF-1.4"
+    assert [p.name for p in cache.path_for(key).parent.iterdir()] == [key + ".pdf"]
+
+
+def test_store_is_locked(tmp_path):
+    cache = SharedCache(tmp_path / "shared")
+    src = tmp_path / "src.pdf"
+    src.write_bytes(b"%PDF-1.4")
+    key = cache_key("abc")
+    lock_path = cache.path_for(key).with_suffix(".lock")
+    lock_path.parent.mkdir(parents=True)
+    lock_path.touch()
+
+    # ほかの人が書き込み中
+    assert not cache.store(key, src)
+    # 古いロックは消して書き込む
+    cache.stale_lock = 0
+    assert cache.store(key, src)
+    assert not lock_path.exists()
+
+
+def test_store_after_other_writer(tmp_path, monkeypatch):
+    cache = SharedCache(tmp_path / "shared")
+    src = tmp_path / "src.pdf"
+    src.write_bytes(b"%PDF-1.4 mine")
+    key = cache_key("abc")
+    path = cache.path_for(key)
+    lock = cache._lock
+
+    def lock_after_other_writer(lock_path):
+        # ロックを取るまでの間に、ほかの人が書き終えた
+        path.write_bytes(b"%PDF-1.4 theirs")
+        return lock(lock_path)
+
+    monkeypatch.setattr(cache, "_lock", lock_after_other_writer)
+    assert not cache.store(key, src)
+    assert path.read_bytes() == b"%PDF-1.4 theirs"
+    assert not path.with_suffix(".lock").exists()
+
+
+def test_unlock_keeps_others_lock(tmp_path):
+    cache = SharedCache(tmp_path / "shared")
+    lock_path = tmp_path / "a.lock"
+    token = cache._lock(lock_path)
+    assert token is not None
+    assert cache._lock(lock_path) is None
+
+    # 古いとみなされて、ほかの人が作り直したロックは消さない
+    lock_path.write_bytes(b"other")
+    cache._unlock(lock_path, token)
+    assert lock_path.exists()
@@ -0,0 +1,30 @@
+import json
+
+from pdf_preview.state_store import SelectionStore
+
+
+def test_save_is_coalesced(tmp_path):
+    path = tmp_path / "folder.PDF.json"
+    store = SelectionStore(path, delay=60)
+    for i in range(10):
+        store.save({"files": ["book{}.xlsx".format(i)], "sheets": {}})
+    # まだ書き込んでいない
+    assert not path.exists()
+    assert store.load() == {"files": ["book9.xlsx"], "sheets": {}}
+
+    store.flush()
+    assert json.loads(path.read_text(encoding="utf-8")) == {"files": ["book9.xlsx"], "sheets": {}}
+    # 一時ファイルは残らない
+    assert [p.name for p in tmp_path.iterdir()] == ["folder.PDF.json"]
+
+
+def test_load(tmp_path):
+    path = tmp_path / "folder.PDF.json"
+    assert SelectionStore(path).load() is None
+
+    path.write_text('{"files": ["あ.xlsx"], "sheets": {}}', encoding="utf-8")
+    assert SelectionStore(path).load() == {"files": ["あ.xlsx"], "sheets": {}}
+
+    # 書きかけのファイルは読み込まない
+    path.write_text('{"files": [', encoding="utf-8")
+    assert SelectionStore(path).load() is None
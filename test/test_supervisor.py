@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from pdf_preview.supervisor import ConversionCancelled, ConversionStats, ConversionTimeout, Supervisor
+
+
+class FakeOffice(object):
+    def __init__(self, stop: threading.Event):
+        self.stop = stop
+
+    def kill(self):
+        self.stop.set()
+        return True
+
+
+class UnkillableOffice(object):
+    """プロセス ID がわからず終了させられない Office"""
+
+    def kill(self):
+        return False
+
+
+def test_timeout_kills_office(tmp_path):
+    stats = ConversionStats(tmp_path / "conversion_stats.json")
+    supervisor = Supervisor(0.1, stats)
+    stop = threading.Event()
+
+    def hang(on_office):
+        on_office(FakeOffice(stop))
+        stop.wait(10)
+
+    def convert(on_office):
+        on_office(FakeOffice(threading.Event()))
+        return "ok.pdf"
+
+    def error(on_office):
+        on_office(FakeOffice(threading.Event()))
+        return int("x")
+
+    with pytest.raises(ConversionTimeout):
+        supervisor.run("hang.xlsx", hang)
+    assert stop.is_set()
+
+    assert supervisor.run("ok.xlsx", convert) == "ok.pdf"
+    with pytest.raises(ValueError):
+        supervisor.run("error.xlsx", error)
+
+    # 記録は flush した時に書き込む
+    assert not (tmp_path / "conversion_stats.json").exists()
+    supervisor.flush()
+
+    stats = ConversionStats(tmp_path / "conversion_stats.json")
+    assert stats.get("hang.xlsx")["timeouts"] == 1
+    assert stats.get("ok.xlsx")["count"] == 1
+    assert stats.get("ok.xlsx")["last_result"] == "ok"
+    assert stats.get("error.xlsx")["failures"] == 1
+
+
+def test_without_office_is_not_recorded(tmp_path):
+    stats = ConversionStats(tmp_path / "conversion_stats.json")
+    supervisor = Supervisor(0.1, stats)
+
+    # キャッシュを使って Office を起動しなかった変換
+    assert supervisor.run("cached.xlsx", lambda on_office: "cached.pdf") == "cached.pdf"
+    with pytest.raises(ValueError):
+        supervisor.run("missing.xlsx", lambda on_office: int("x"))
+    supervisor.flush()
+    assert stats.get("cached.xlsx") == {}
+    assert stats.get("missing.xlsx") == {}
+    assert not (tmp_path / "conversion_stats.json").exists()
+
+
+def test_cancel_kills_running_office():
+    supervisor = Supervisor(10)
+    stop = threading.Event()
+    launched = threading.Event()
+    outcome = {}
+
+    def hang(on_office):
+        on_office(FakeOffice(stop))
+        launched.set()
+        stop.wait(10)
+
+    def target():
+        try:
+            supervisor.run("prefetch.xlsx", hang)
+        except ConversionCancelled:
+            outcome["cancelled"] = True
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    assert launched.wait(5)
+    supervisor.cancel()
+    thread.join(5)
+    assert stop.is_set()
+    assert outcome == {"cancelled": True}
+
+    # 後から起動した Office もすぐに終了させる
+    later = threading.Event()
+    with pytest.raises(ConversionCancelled):
+        supervisor.run("later.xlsx", lambda on_office: on_office(FakeOffice(later)))
+    assert later.is_set()
+
+
+def test_timeout_without_kill(tmp_path):
+    stats = ConversionStats(tmp_path / "conversion_stats.json")
+    supervisor = Supervisor(0.1, stats, grace=0.1)
+    release = threading.Event()
+
+    def hang(on_office):
+        on_office(UnkillableOffice())
+        release.wait(10)
+        return "late.pdf"
+
+    # Office を終了させられなくても、待つのをやめて次に進む
+    with pytest.raises(ConversionTimeout):
+        supervisor.run("hang.docx", hang)
+    supervisor.flush()
+    assert stats.get("hang.docx")["timeouts"] == 1
+
+    # 止まったままの間は、同じブックを変換しない
+    with pytest.raises(ConversionTimeout):
+        supervisor.run("hang.docx", lambda on_office: "cached.pdf")
+    assert supervisor.run("other.docx", lambda on_office: "other.pdf") == "other.pdf"
+
+    release.set()
+    for _ in range(100):
+        try:
+            assert supervisor.run("hang.docx", lambda on_office: "cached.pdf") == "cached.pdf"
+            break
+        except ConversionTimeout:
+            time.sleep(0.05)
+    else:
+        pytest.fail("hang.docx stays hung")
@@ -0,0 +1,62 @@
+from pypdf import PdfWriter
+
+from pdf_preview import thumbnails
+from pdf_preview.page_diff import load_page_hashes
+from pdf_preview.thumbnails import render_thumbnails, thumbnail_dir, thumbnail_name
+
+
+def test_render_thumbnails(tmp_path, qapp):
+    pdf = tmp_path / "book.pdf"
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=300)
+    writer.add_blank_page(width=300, height=200)
+    with open(pdf, "wb") as f:
+        writer.write(f)
+
+    pages = render_thumbnails(pdf)
+    assert [p.name for p in pages] == [thumbnail_name(h) for h in load_page_hashes(pdf)]
+    assert all(p.parent == thumbnail_dir(pdf) for p in pages)
+
+    # 作成済みのサムネイルを使う
+    mtime = pages[0].stat().st_mtime_ns
+    assert render_thumbnails(pdf) == pages
+    assert pages[0].stat().st_mtime_ns == mtime
+
+    # 変わったページだけ作り直す
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=300)
+    writer.add_blank_page(width=400, height=200)
+    with open(pdf, "wb") as f:
+        writer.write(f)
+    new_pages = render_thumbnails(pdf)
+    assert new_pages[0] == pages[0]
+    assert new_pages[0].stat().st_mtime_ns == mtime
+    assert new_pages[1] != pages[1]
+    assert not pages[1].exists()
+
+
+def test_task_keeps_page_numbers(tmp_path, qapp, monkeypatch):
+    books = [tmp_path / "a.pdf", tmp_path / "b.pdf", tmp_path / "c.pdf"]
+    for book in books:
+        writer = PdfWriter()
+        writer.add_blank_page(width=200, height=300)
+        writer.add_blank_page(width=300, height=200)
+        with open(book, "wb") as f:
+            writer.write(f)
+
+    def render(pdf):
+        if pdf == books[1]:
+            raise IOError(pdf)
+        return render_thumbnails(pdf)
+
+    monkeypatch.setattr(thumbnails, "render_thumbnails", render)
+    ready = []
+    task = thumbnails.ThumbnailTask(books, 2)
+    task.obj_connection.ready.connect(lambda paths, generation: ready.append((paths, generation)))
+    task.run()
+
+    # 作れなかったブックのページは空にして、後のブックのページ番号を合わせる
+    paths, generation = ready[0]
+    assert generation == 2
+    assert paths[2:4] == ["", ""]
+    assert paths[4:] == [str(p) for p in render_thumbnails(books[2])]
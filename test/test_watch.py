@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from pypdf import PdfReader, PdfWriter
+
+from pdf_preview import pipeline, saveAsPDF, util
+from pdf_preview.watch import FolderWatcher, scan
+
+
+def test_scan(tmp_path):
+    (tmp_path / "sub" / "subsub").mkdir(parents=True)
+    (tmp_path / "a.xlsx").write_bytes(b"a")
+    (tmp_path / "~$a.xlsx").write_bytes(b"lock")
+    (tmp_path / "sub" / "b.docx").write_bytes(b"bb")
+    (tmp_path / "sub" / "c.txt").write_bytes(b"c")
+
+    files, folders = scan(tmp_path)
+    assert sorted(files) == ["a.xlsx", str(Path("sub") / "b.docx")]
+    assert files["a.xlsx"][0] == 1
+    assert sorted(folders) == [tmp_path, tmp_path / "sub", tmp_path / "sub" / "subsub"]
+
+
+class FakeExcel(object):
+    """PDF を作るだけの Excel"""
+    converted = []
+
+    def kill(self):
+        return True
+
+    def saveAsPDF(self, filename, pdf_filename, selected_sheet=None, draft=False):
+        FakeExcel.converted.append(Path(filename).name)
+        writer = PdfWriter()
+        writer.add_blank_page(width=100, height=100)
+        with open(pdf_filename, "wb") as f:
+            writer.write(f)
+
+
+def test_poll(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(util, "cache_dir", lambda: cache_dir)
+    monkeypatch.setattr(saveAsPDF, "Excel", FakeExcel)
+    monkeypatch.setattr(FakeExcel, "converted", [])
+
+    root = tmp_path / "root"
+    (root / "book").mkdir(parents=True)
+    (root / "other" / "book").mkdir(parents=True)
+    for path in [root / "book" / "a.xlsx", root / "book" / "b.xlsx", root / "other" / "book" / "c.xlsx"]:
+        path.write_bytes(b"x")
+    # 同じ名前のフォルダは状態ファイルを共有するが、状態は root/book のもの
+    output_path = pipeline.folder_output_path(root / "book")
+    util.write_json_atomic(pipeline.state_path(output_path),
+                           {"folder": str(root / "book"), "files": ["a.xlsx"], "sheets": {}})
+
+    watcher = FolderWatcher(root, max_workers=1)
+    watcher.poll()
+    assert FakeExcel.converted == ["a.xlsx"]
+    assert len(PdfReader(output_path).pages) == 1
+
+    # 変わっていないブックは変換し直さない
+    watcher.poll()
+    assert FakeExcel.converted == ["a.xlsx"]
+
+    # --all の場合は選択されていないブックも変換する
+    watcher = FolderWatcher(root, max_workers=1, convert_all=True)
+    watcher.poll()
+    assert sorted(FakeExcel.converted) == ["a.xlsx", "b.xlsx", "c.xlsx"]